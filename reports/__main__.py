@@ -0,0 +1,74 @@
+"""
+Runs the report collectors concurrently on one asyncio event loop:
+   python -m reports [--jobs extensions availability admin-reports marketplace] [--concurrency 16]
+
+Each job runs its collector in a worker thread. All jobs share http_client, so --concurrency
+caps the requests in flight across all of them, on top of the per-host rate limits. Collector
+modules are imported only when their job runs, and pandas/numpy only where DataFrames or
+arrays are built.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import traceback
+
+# The report scripts import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import http_client
+
+def collect_extensions(args):
+    import get_all_extensions
+    get_all_extensions.collect(args.resume)
+
+def collect_availability(args):
+    import get_availability_data
+    get_availability_data.get_monthly_data()
+    get_availability_data.get_continuous_data()
+
+def collect_admin_reports(args):
+    import get_open_vsx_data
+    get_open_vsx_data.collect()
+
+def collect_marketplace(args):
+    import get_vs_marketplace_data
+    get_vs_marketplace_data.collect(args.resume)
+
+JOBS = {
+    'extensions': collect_extensions,
+    'availability': collect_availability,
+    'admin-reports': collect_admin_reports,
+    'marketplace': collect_marketplace
+}
+
+async def run_job(name, args):
+    start = time.monotonic()
+    try:
+        await asyncio.to_thread(JOBS[name], args)
+    except Exception:
+        print('%s failed after %.1fs' % (name, time.monotonic() - start))
+        traceback.print_exc()
+        return False
+    print('%s finished in %.1fs' % (name, time.monotonic() - start))
+    return True
+
+async def run_jobs(names, args):
+    results = await asyncio.gather(*(run_job(name, args) for name in names))
+    return all(results)
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m reports', description='Run the report collectors concurrently.')
+    parser.add_argument('--jobs', nargs='+', choices=list(JOBS), default=list(JOBS), help='collectors to run, all by default')
+    parser.add_argument('--concurrency', type=int, default=http_client.MAX_CONCURRENT_REQUESTS,
+                        help='maximum requests in flight across all jobs (default %(default)s), 0 for no limit')
+    parser.add_argument('--resume', action='store_true', help='resume interrupted crawls from their checkpoint journals')
+    args = parser.parse_args()
+
+    http_client.set_concurrency_limit(args.concurrency)
+    if not asyncio.run(run_jobs(args.jobs, args)):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
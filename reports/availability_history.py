@@ -0,0 +1,47 @@
+"""
+Append-only history of the availability series collected by get_availability_data. Each
+monitor/series pair is a flat file of SERIES_DTYPE records (date, availability %, downtime
+minutes) that only ever grows, so a notebook can memory-map years of history at once:
+
+    history = availability_history.read_history(monitor_id, 'monthly')
+    plt.plot(history['date'], history['availability'])
+"""
+import os
+import numpy as np
+
+HISTORY_DIR = os.getenv('HISTORY_DIR', 'availability_history')
+
+SERIES_DTYPE = np.dtype([('date', 'datetime64[D]'), ('availability', '<f8'), ('downtime', '<f8')])
+
+def get_history_path(monitor_id, kind, history_dir=HISTORY_DIR):
+    return os.path.join(history_dir, '%s-%s.bin' % (monitor_id, kind))
+
+def read_history(monitor_id, kind, history_dir=HISTORY_DIR):
+    """Returns the stored records as a read-only memory-mapped structured array."""
+    path = get_history_path(monitor_id, kind, history_dir)
+    try:
+        # Ignore a partial record left behind by an interrupted append
+        records = os.path.getsize(path) // SERIES_DTYPE.itemsize
+    except FileNotFoundError:
+        records = 0
+    if records == 0:
+        return np.empty(0, dtype=SERIES_DTYPE)
+    return np.memmap(path, dtype=SERIES_DTYPE, mode='r', shape=(records,))
+
+def append_history(monitor_id, kind, dates, availability, downtime, history_dir=HISTORY_DIR):
+    if len(dates) == 0:
+        return
+    rows = np.empty(len(dates), dtype=SERIES_DTYPE)
+    rows['date'] = np.array(dates).astype('datetime64[D]')
+    rows['availability'] = availability
+    rows['downtime'] = downtime
+    os.makedirs(history_dir, exist_ok=True)
+    path = get_history_path(monitor_id, kind, history_dir)
+    with open(path, 'ab') as f:
+        partial = f.tell() % SERIES_DTYPE.itemsize
+        if partial:
+            f.truncate(f.tell() - partial)
+            f.seek(0, os.SEEK_END)
+        f.write(rows.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
@@ -0,0 +1,101 @@
+"""
+Offline benchmark for the report collectors. Starts stand_in_api.py on a local port with a
+synthetic catalog, runs each collector in its own process against it and records wall time,
+request count, repeated requests (retries), injected errors and peak RSS. For example:
+   python benchmark.py --extensions 100000 --latency 20 --error-rate 0.01 --output results.json
+
+Environment variables such as MAX_WORKERS or PAGE_WORKERS are passed on to the collectors,
+so the same catalog can be measured with different settings. Set HTTP_RATE_LIMIT=0 and
+MAX_REQUESTS_PER_SECOND high to measure the collectors without the client-side rate limits.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from stand_in_api import Catalog, StandInServer
+
+REPORTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+COLLECTORS = {
+    'extensions': [os.path.join(REPORTS_DIR, 'get_all_extensions.py')],
+    'availability': ['-c', 'import get_availability_data as g; g.get_continuous_data(); g.get_monthly_data()'],
+    'admin-reports': ['-c', 'import get_open_vsx_data as g; g.get_publishing_data(%(year)s, %(month)s); g.get_most_active_data(%(year)s, %(month)s)'],
+    'marketplace': [os.path.join(REPORTS_DIR, 'get_vs_marketplace_data.py')]
+}
+
+def get_collector_env(base_url):
+    env = dict(os.environ)
+    env.update({
+        'API_ENDPOINT': base_url,
+        'BETTER_STACK_API_URL': base_url + 'api/v2',
+        'MS_API_URL': base_url + '_apis/public/gallery/extensionquery',
+        'TOKEN': 'benchmark',
+        'ACCESS_TOKEN': 'benchmark',
+        'PYTHONPATH': os.pathsep.join(filter(None, [REPORTS_DIR, os.getenv('PYTHONPATH')]))
+    })
+    return env
+
+def run_collector(server, name, args, verbose=False):
+    """Runs one collector in a fresh working directory and returns its measurements."""
+    server.reset_stats()
+    with tempfile.TemporaryDirectory() as work_dir:
+        output = None if verbose else subprocess.DEVNULL
+        start = time.monotonic()
+        process = subprocess.Popen([sys.executable] + args, cwd=work_dir, env=get_collector_env(server.base_url),
+                                   stdout=output, stderr=output)
+        # wait4 reports the resource usage of this child alone; ru_maxrss is in KiB on Linux
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_time = time.monotonic() - start
+    stats = server.get_stats()
+    return {
+        'collector': name,
+        'exit_code': os.waitstatus_to_exitcode(status),
+        'wall_time': round(wall_time, 3),
+        'requests': stats.get('requests', 0),
+        'repeated_requests': stats['repeated_requests'],
+        'injected_errors': stats.get('status.503', 0),
+        'bytes': stats.get('bytes', 0),
+        'peak_rss_mb': round(usage.ru_maxrss / 1024, 1),
+        'stats': stats
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--extensions', type=int, default=10000, help='Open VSX catalog size')
+    parser.add_argument('--ms-extensions', type=int, default=None, help='Marketplace catalog size, defaults to --extensions')
+    parser.add_argument('--overlap', type=float, default=0.5, help='share of Marketplace extensions also on Open VSX')
+    parser.add_argument('--monitors', type=int, default=4, help='number of Better Stack monitors')
+    parser.add_argument('--days', type=int, default=365, help='days of monitor and report history')
+    parser.add_argument('--latency', type=float, default=0, help='mean response latency in milliseconds')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of requests answered with 503')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--collectors', nargs='+', choices=list(COLLECTORS), default=list(COLLECTORS))
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--verbose', action='store_true', help='show collector output')
+    args = parser.parse_args()
+
+    catalog = Catalog(args.extensions, args.ms_extensions, args.overlap, monitors=args.monitors, days=args.days, seed=args.seed)
+    server = StandInServer(catalog, latency=args.latency / 1000, error_rate=args.error_rate)
+    server.start()
+    first_year, first_month = next(catalog.get_report_months(), (catalog.start_date.year, catalog.start_date.month))
+
+    results = []
+    print('%-15s %6s %10s %10s %10s %8s %12s %10s' % ('collector', 'exit', 'seconds', 'requests', 'repeated', 'errors', 'bytes', 'rss MB'))
+    for name in args.collectors:
+        collector_args = [arg % {'year': first_year, 'month': first_month} for arg in COLLECTORS[name]]
+        result = run_collector(server, name, collector_args, args.verbose)
+        results.append(result)
+        print('%-15s %6s %10.2f %10s %10s %8s %12s %10.1f' % (name, result['exit_code'], result['wall_time'], result['requests'],
+                                                             result['repeated_requests'], result['injected_errors'],
+                                                             result['bytes'], result['peak_rss_mb']))
+    server.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=4)
+
+if __name__ == '__main__':
+    main()
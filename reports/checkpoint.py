@@ -0,0 +1,103 @@
+"""
+Append-only checkpoint journal for long-running crawls. Every completed page and item is
+appended as one JSON line and flushed, so after a crash a run started with --resume can
+reuse them instead of fetching them again. The journal is removed once a run completes.
+
+Only the page indexes and item keys are kept in memory, with the offset of their line in the
+journal, so a crawl's memory use does not grow with the catalog. Reused records are read
+back from the file when they are needed.
+"""
+import json
+import os
+import threading
+
+# Force the journal to disk after this many records, in addition to flushing every line
+FSYNC_INTERVAL = 100
+
+class Journal:
+
+    def __init__(self, filename, resume=False):
+        self.filename = filename
+        self.pages = {}
+        self.items = {}
+        self.lock = threading.Lock()
+        self.pending_sync = 0
+        if resume:
+            self.load()
+        self.file = open(filename, 'ab' if resume else 'wb')
+        self.reader = open(filename, 'rb')
+
+    def load(self):
+        try:
+            f = open(self.filename, 'rb+')
+        except FileNotFoundError:
+            return
+        with f:
+            offset = 0
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError('incomplete record')
+                    record = json.loads(line)
+                except ValueError:
+                    # The last line may be cut short if the previous run died while writing it.
+                    # Drop it so the records appended by this run start on a line of their own.
+                    f.truncate(offset)
+                    break
+                if record['type'] == 'page':
+                    self.pages[(record['kind'], record['index'])] = offset
+                else:
+                    self.items[record['key']] = offset
+                offset += len(line)
+        print('Resuming from %s: %s pages, %s items' % (self.filename, len(self.pages), len(self.items)))
+
+    def append(self, record):
+        """Appends record and returns the offset of its line."""
+        with self.lock:
+            offset = self.file.tell()
+            self.file.write(json.dumps(record).encode() + b'\n')
+            self.file.flush()
+            self.pending_sync += 1
+            if self.pending_sync >= FSYNC_INTERVAL:
+                os.fsync(self.file.fileno())
+                self.pending_sync = 0
+        return offset
+
+    def read(self, offset):
+        with self.lock:
+            self.reader.seek(offset)
+            return json.loads(self.reader.readline())
+
+    def get_page(self, kind, index):
+        offset = self.pages.get((kind, index))
+        if offset is None:
+            return None
+        record = self.read(offset)
+        return record['items'], record['total']
+
+    def record_page(self, kind, index, items, total):
+        if (kind, index) not in self.pages:
+            self.pages[(kind, index)] = self.append({'type': 'page', 'kind': kind, 'index': index, 'items': items, 'total': total})
+
+    def has_item(self, key):
+        return key in self.items
+
+    def get_item(self, key):
+        offset = self.items.get(key)
+        return None if offset is None else self.read(offset)['data']
+
+    def record_item(self, key, data):
+        if key not in self.items:
+            self.items[key] = self.append({'type': 'item', 'key': key, 'data': data})
+
+    def close(self):
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.reader.close()
+
+    def complete(self):
+        """Closes and removes the journal once everything it protects has been written out."""
+        self.close()
+        os.remove(self.filename)
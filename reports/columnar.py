@@ -0,0 +1,149 @@
+"""
+Columnar (Parquet) output for the extension and marketplace datasets. Requires pyarrow,
+which is only imported by the scripts when Parquet output is requested.
+
+Load a dataset in a notebook with, for example:
+    columnar.read_table('extensions.parquet', columns=['namespace', 'license'])
+"""
+from datetime import datetime
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Rows are buffered and written as one row group per batch to keep memory flat
+BATCH_SIZE = 10000
+
+EXTENSION_SCHEMA = pa.schema([
+    ('namespace', pa.string()),
+    ('name', pa.string()),
+    ('version', pa.string()),
+    ('display_name', pa.string()),
+    ('description', pa.string()),
+    ('license', pa.string()),
+    ('timestamp', pa.timestamp('us', tz='UTC')),
+    ('download_count', pa.int64()),
+    ('review_count', pa.int64()),
+    ('average_rating', pa.float64()),
+    ('publisher_login', pa.string()),
+    ('publisher_full_name', pa.string()),
+    ('pre_release', pa.bool_()),
+    ('verified', pa.bool_()),
+    ('unrelated_publisher', pa.bool_()),
+    ('namespace_access', pa.string()),
+    ('preview', pa.bool_()),
+    ('deprecated', pa.bool_()),
+    ('homepage', pa.string()),
+    ('repository', pa.string()),
+    ('bugs', pa.string()),
+    ('categories', pa.list_(pa.string())),
+    ('tags', pa.list_(pa.string())),
+    ('versions', pa.list_(pa.string())),
+    ('files', pa.map_(pa.string(), pa.string())),
+    ('dependencies', pa.list_(pa.string())),
+    ('bundled_extensions', pa.list_(pa.string()))
+])
+
+MARKETPLACE_SCHEMA = pa.schema([
+    ('ms_publisher', pa.string()),
+    ('ms_extension', pa.string()),
+    ('ms_display_name', pa.string()),
+    ('ms_pricing', pa.string()),
+    ('ms_version', pa.string()),
+    ('ms_date', pa.timestamp('us', tz='UTC')),
+    ('vsx_version', pa.string()),
+    ('vsx_date', pa.timestamp('us', tz='UTC')),
+    ('vsx_publisher', pa.string()),
+    ('vsx_license', pa.string()),
+    ('repo', pa.string())
+])
+
+def parse_timestamp(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
+def get_extension_ids(references):
+    return ['%s.%s' % (reference['namespace'], reference['extension']) for reference in references or []]
+
+def get_extension_row(e):
+    publisher = e.get('publishedBy', {})
+    return {
+        'namespace': e['namespace'],
+        'name': e['name'],
+        'version': e.get('version'),
+        'display_name': e.get('displayName'),
+        'description': e.get('description'),
+        'license': e.get('license'),
+        'timestamp': parse_timestamp(e.get('timestamp')),
+        'download_count': e.get('downloadCount'),
+        'review_count': e.get('reviewCount'),
+        'average_rating': e.get('averageRating'),
+        'publisher_login': publisher.get('loginName'),
+        'publisher_full_name': publisher.get('fullName'),
+        'pre_release': e.get('preRelease'),
+        'verified': e.get('verified'),
+        'unrelated_publisher': e.get('unrelatedPublisher'),
+        'namespace_access': e.get('namespaceAccess'),
+        'preview': e.get('preview'),
+        'deprecated': e.get('deprecated'),
+        'homepage': e.get('homepage'),
+        'repository': e.get('repository'),
+        'bugs': e.get('bugs'),
+        'categories': e.get('categories'),
+        'tags': e.get('tags'),
+        'versions': list(e.get('allVersions', {}).keys()),
+        'files': list(e.get('files', {}).items()),
+        'dependencies': get_extension_ids(e.get('dependencies')),
+        'bundled_extensions': get_extension_ids(e.get('bundledExtensions'))
+    }
+
+def get_marketplace_row(ms_publisher, ms_extension, ms_display_name, ms_pricing, ms_version, ms_date,
+                        vsx_version, vsx_date, vsx_publisher, vsx_license, repo):
+    return {
+        'ms_publisher': ms_publisher,
+        'ms_extension': ms_extension,
+        'ms_display_name': ms_display_name,
+        'ms_pricing': ms_pricing,
+        'ms_version': ms_version,
+        'ms_date': parse_timestamp(ms_date),
+        'vsx_version': vsx_version,
+        'vsx_date': parse_timestamp(vsx_date),
+        'vsx_publisher': vsx_publisher,
+        'vsx_license': vsx_license,
+        'repo': repo
+    }
+
+class ParquetRowWriter:
+    """Writes dict rows to a Parquet file in batches of batch_size rows."""
+
+    def __init__(self, filename, schema, batch_size=BATCH_SIZE):
+        self.schema = schema
+        self.batch_size = batch_size
+        self.rows = []
+        self.writer = pq.ParquetWriter(filename, schema)
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.writer.write_table(pa.Table.from_pylist(self.rows, schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+def read_table(filename, columns=None):
+    """Loads only the requested columns, memory-mapping the file instead of reading it into memory."""
+    return pq.read_table(filename, columns=columns, memory_map=True)
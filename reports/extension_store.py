@@ -0,0 +1,86 @@
+"""
+Indexed local store for crawled extension data. Loads an extensions.ndjson snapshot written by
+get_all_extensions.py into SQLite with indexes on license, namespace, publisher, verified and
+timestamp, so license, namespace and publisher breakdowns can be queried without a new crawl.
+
+    store = ExtensionStore('extensions.sqlite')
+    store.load('extensions.ndjson')
+    store.count_by('license')
+    store.find(namespace='redhat', verified=True)
+"""
+import json
+import os
+import sqlite3
+
+STORE_FILENAME = 'extensions.sqlite'
+
+# Columns that can be used for grouping and filtering; each has an index
+INDEXED_COLUMNS = ['license', 'namespace', 'publisher_login', 'verified', 'timestamp']
+
+class ExtensionStore:
+
+    def __init__(self, filename=STORE_FILENAME):
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS extensions (
+            key TEXT PRIMARY KEY,
+            namespace TEXT NOT NULL,
+            name TEXT NOT NULL,
+            version TEXT,
+            license TEXT,
+            publisher_login TEXT,
+            verified INTEGER,
+            timestamp TEXT,
+            download_count INTEGER,
+            document TEXT NOT NULL
+        )''')
+        for column in INDEXED_COLUMNS:
+            self.connection.execute('CREATE INDEX IF NOT EXISTS extensions_%s ON extensions (%s)' % (column, column))
+
+    def load(self, snapshot_filename):
+        """Replaces the store contents with the snapshot, streaming it line by line."""
+        def rows():
+            with open(snapshot_filename) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    e = json.loads(line)
+                    yield ('%s.%s' % (e['namespace'], e['name']), e['namespace'], e['name'], e.get('version'),
+                           e.get('license'), e.get('publishedBy', {}).get('loginName'), e.get('verified'),
+                           e.get('timestamp'), e.get('downloadCount'), line)
+
+        with self.connection:
+            self.connection.execute('DELETE FROM extensions')
+            self.connection.executemany('INSERT OR REPLACE INTO extensions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows())
+        count = self.connection.execute('SELECT COUNT(*) FROM extensions').fetchone()[0]
+        print('Loaded %s extensions from %s' % (count, snapshot_filename))
+
+    def get_where_clause(self, filters):
+        for column in filters:
+            if column not in INDEXED_COLUMNS:
+                raise ValueError('Cannot filter on %s, use one of %s' % (column, ', '.join(INDEXED_COLUMNS)))
+        if not filters:
+            return '', []
+        conditions = ['%s IS NULL' % column if value is None else '%s = ?' % column for column, value in filters.items()]
+        return ' WHERE ' + ' AND '.join(conditions), [value for value in filters.values() if value is not None]
+
+    def count_by(self, column, **filters):
+        """Returns {value: number of extensions} for column, optionally restricted by filters."""
+        if column not in INDEXED_COLUMNS:
+            raise ValueError('Cannot group by %s, use one of %s' % (column, ', '.join(INDEXED_COLUMNS)))
+        where, params = self.get_where_clause(filters)
+        query = 'SELECT %s, COUNT(*) FROM extensions%s GROUP BY %s ORDER BY %s' % (column, where, column, column)
+        return dict(self.connection.execute(query, params).fetchall())
+
+    def find(self, limit=None, **filters):
+        """Returns the extension documents matching all filters, e.g. find(license='MIT')."""
+        where, params = self.get_where_clause(filters)
+        query = 'SELECT document FROM extensions%s ORDER BY key' % where
+        if limit is not None:
+            query += ' LIMIT %d' % limit
+        return [json.loads(row[0]) for row in self.connection.execute(query, params)]
+
+    def close(self):
+        self.connection.close()
+
+def store_exists(filename=STORE_FILENAME):
+    return os.path.exists(filename)
@@ -2,72 +2,263 @@
 Script to collect metadata on all published extensions. Used by Jupyter notebooks.
 """
 import requests
+import argparse
 import os
 import json
-import time
-from datetime import datetime
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+import checkpoint
+import extension_store
+import http_client
+import metrics
+import pagination
 
-API_ENDPOINT = "https://open-vsx.org/"
+API_ENDPOINT = os.getenv('API_ENDPOINT', "https://open-vsx.org/")
 
 JSON_FILENAME = 'extensions.json'
+NDJSON_FILENAME = 'extensions.ndjson'
+PARQUET_FILENAME = 'extensions.parquet'
 TSV_FILENAME = 'extensions.tsv'
+JOURNAL_FILENAME = 'extensions.journal'
 
-url = API_ENDPOINT + 'api/-/search?size=100'
+TSV_COLUMNS = ['Name', 'Namespace', 'Versions', 'Login Name',
+               'Full Name', 'License', 'Timestamp', 'Downloads', 'Reviews', 'Files',
+               'PreRelease', 'Verified', 'Unrelated Publisher', 'Namespace Access', 'Preview',
+               'Homepage', 'Repo', 'Bugs', 'Bundled Extensions']
 
-def retrieve_extensions():
+# Number of extension detail requests to run in parallel, 1 keeps the crawl sequential
+MAX_WORKERS = int(os.getenv('MAX_WORKERS', '1'))
+
+# Also write a Parquet file (requires pyarrow), see columnar.py
+OUTPUT_PARQUET = os.getenv('OUTPUT_PARQUET', 'false').lower() == 'true'
+
+# Incremental mode reuses extension documents cached in CACHE_DIR from earlier runs
+INCREMENTAL = os.getenv('INCREMENTAL', 'false').lower() == 'true'
+CACHE_DIR = os.getenv('CACHE_DIR', 'extension_cache')
+
+# Counters that change without a new version. The search entries carry current values, which
+# replace those in cached extension documents
+VOLATILE_FIELDS = ['downloadCount', 'averageRating', 'reviewCount']
+
+# SQLite store loaded with each snapshot and used for queries instead of a new crawl, see extension_store.py
+EXTENSION_STORE = os.getenv('EXTENSION_STORE')
+
+# Summary mode writes the search results alone to a time-stamped file here, see collect_summary
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', 'snapshots')
+
+cache_stats = Counter()
+cache_stats_lock = threading.Lock()
+
+PAGE_SIZE = 100
+
+url = API_ENDPOINT + 'api/-/search?size=%s' % PAGE_SIZE
+# Metrics name shared by all extension detail requests
+EXTENSION_ENDPOINT = '%s/api/{namespace}/{name}' % urlparse(API_ENDPOINT).hostname
+
+def get_search_page(index):
+    search_url = url + '&offset=%s' % (index * PAGE_SIZE)
+    response = http_client.get(search_url)
+    response.raise_for_status()
+    results = response.json()
+    return results['extensions'], results['totalSize']
+
+def iter_search_pages(journal=None):
+    """Yields (extensions, total_size) for each page of search results."""
+    retrieved = 0
+    for page, total_size in pagination.iter_pages(get_search_page, PAGE_SIZE, journal=journal, kind='search'):
+        retrieved += len(page)
+        print('Retrieved %s of %s extensions' % (retrieved, total_size))
+        yield page, total_size
+
+def retrieve_extensions(journal=None):
     extensions = []
-    done = False
-    offset = 0
-    while not done:
-        search_url = url + '&offset=%s' % offset
-        try:
-            response = requests.get(search_url)
-            results = response.json()
-            extensions = extensions + results['extensions']
-            offset = len(extensions)
-            print('Retrieved %s extensions' % len(extensions))
-            if len(extensions) == results['totalSize']:
-                done = True
-        except Exception as e:
-            print("%s: %s" % (datetime.now(), e))
-            done = True
+    for page, total_size in iter_search_pages(journal):
+        extensions.extend(page)
 
     return extensions
 
-def get_extension(extension):
+def request_extension(extension, headers=None):
     extension_url = API_ENDPOINT + 'api/%s/%s' % (extension['namespace'], extension['name'])
-    retry_count = 5
-    while retry_count > 0:
-        try:
-            response = requests.get(extension_url)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print("%s: %s" % (datetime.now(), e))
-            retry_count -= 1
-            time.sleep(2)
+    try:
+        # http_client retries connection errors and throttling, so any error here is final
+        response = http_client.get(extension_url, headers=headers, endpoint=EXTENSION_ENDPOINT)
+        response.raise_for_status()
+        return response
+    except requests.exceptions.RequestException as e:
+        print("%s: %s" % (datetime.now(), e))
 
     return None
 
-def get_all_extensions():
+def get_extension(extension):
+    response = request_extension(extension)
+    if response is None:
+        return None
+    return response.json()
+
+def get_cache_path(extension):
+    return os.path.join(CACHE_DIR, extension['namespace'], '%s.json' % extension['name'])
+
+def read_cache_entry(extension):
+    try:
+        with open(get_cache_path(extension)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_cache_entry(extension, entry):
+    path = get_cache_path(extension)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary file first so an interrupted run never leaves a truncated entry
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(entry, f)
+    os.replace(tmp_path, path)
+
+def count_cache_result(result):
+    with cache_stats_lock:
+        cache_stats[result] += 1
+
+def update_volatile_fields(results, extension):
+    for field in VOLATILE_FIELDS:
+        if field in extension:
+            results[field] = extension[field]
+    return results
+
+def get_cached_extension(extension):
+    """
+    Returns the extension details, only calling the API when the search entry's version or
+    timestamp differ from the cached copy. Changed entries are revalidated with the cached
+    ETag/Last-Modified so an unchanged document costs a 304 instead of a full download.
+    Cached documents get the current VOLATILE_FIELDS of the search entry.
+    """
+    entry = read_cache_entry(extension)
+    if entry is not None and entry['version'] == extension.get('version') and entry['timestamp'] == extension.get('timestamp'):
+        count_cache_result('hit')
+        return update_volatile_fields(entry['extension'], extension)
+
+    headers = {}
+    if entry is not None:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+    response = request_extension(extension, headers)
+    if response is None:
+        return None
+
+    if response.status_code == 304:
+        count_cache_result('not_modified')
+        results = update_volatile_fields(entry['extension'], extension)
+    else:
+        count_cache_result('fetched')
+        results = response.json()
+    write_cache_entry(extension, {
+        'version': extension.get('version'),
+        'timestamp': extension.get('timestamp'),
+        'etag': response.headers.get('ETag', entry.get('etag') if entry else None),
+        'last_modified': response.headers.get('Last-Modified', entry.get('last_modified') if entry else None),
+        'extension': results
+    })
+    return results
+
+def iter_extension_details(extensions, max_workers=MAX_WORKERS, fetch=get_extension):
+    """Yields (extension, details) in input order, keeping at most 2 * max_workers requests in flight."""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for extension in extensions:
+            pending.append((extension, executor.submit(fetch, extension)))
+            if len(pending) >= max_workers * 2:
+                extension, future = pending.popleft()
+                yield extension, future.result()
+        while pending:
+            extension, future = pending.popleft()
+            yield extension, future.result()
+
+def get_extension_key(extension):
+    return '%s.%s' % (extension['namespace'], extension['name'])
+
+def iter_all_extensions(max_workers=MAX_WORKERS, incremental=INCREMENTAL, journal=None):
+    """
+    Yields the details of every extension in catalog order. With a checkpoint journal,
+    extensions completed by an interrupted run are taken from it instead of the API.
+    """
     count = 1
-    all_extensions = []
-    extensions = retrieve_extensions()
-    print("\n\nStarting: %s" % datetime.now())
-    for extension in extensions:
-        results = get_extension(extension)
+    total = {'size': 0}
+
+    def search_results():
+        for page, total_size in iter_search_pages(journal):
+            total['size'] = total_size
+            yield from page
+
+    def fetch(extension):
+        if journal is not None and journal.has_item(get_extension_key(extension)):
+            return journal.get_item(get_extension_key(extension))
+        return get_cached_extension(extension) if incremental else get_extension(extension)
+
+    print("\n\nStarting: %s with %s workers" % (datetime.now(), max_workers))
+    for extension, results in iter_extension_details(search_results(), max_workers, fetch):
         if results is None:
             print('Error retrieving %s' % extension['url'])
         else:
-            all_extensions.append(results)
+            if journal is not None:
+                journal.record_item(get_extension_key(extension), results)
+            metrics.count_items('extensions')
+            yield results
         if int(count/100) == count/100:
-            print('Processed %s of %s.' % (count, len(extensions)))
+            print('Processed %s of %s.' % (count, total['size']))
         count += 1
     print("\n\nFinished %s API Calls: %s" % (count, datetime.now()))
+    if incremental:
+        print("Cache hits: %s, not modified: %s, fetched: %s" % (cache_stats['hit'], cache_stats['not_modified'], cache_stats['fetched']))
+
+def iter_summary_extensions(fields=(), max_workers=MAX_WORKERS, incremental=INCREMENTAL):
+    """
+    Yields the search result entry of every extension in catalog order. These already carry
+    name, namespace, version, timestamp and downloadCount, so extension details are only
+    requested when fields names details to add to each entry.
+    """
+    def search_results():
+        for page, total_size in iter_search_pages():
+            yield from page
+
+    if not fields:
+        for extension in search_results():
+            metrics.count_items('extensions')
+            yield extension
+        return
+
+    fetch = get_cached_extension if incremental else get_extension
+    for extension, results in iter_extension_details(search_results(), max_workers, fetch):
+        if results is None:
+            print('Error retrieving %s' % extension['url'])
+            continue
+        for field in fields:
+            if field in results:
+                extension[field] = results[field]
+        metrics.count_items('extensions')
+        yield extension
 
-    return all_extensions
+def get_all_extensions(max_workers=MAX_WORKERS, incremental=INCREMENTAL):
+    return list(iter_all_extensions(max_workers, incremental))
+
+def get_all_by_license_from_store(store_filename):
+    store = extension_store.ExtensionStore(store_filename)
+    try:
+        extensions_by_license = {}
+        for license_name in store.count_by('license'):
+            extensions_by_license['None' if license_name is None else license_name] = store.find(license=license_name)
+    finally:
+        store.close()
+
+    return dict(sorted(extensions_by_license.items()))
+
+def get_all_by_license(store_filename=EXTENSION_STORE):
+    if store_filename and extension_store.store_exists(store_filename):
+        return get_all_by_license_from_store(store_filename)
 
-def get_all_by_license():
     extensions_by_license = {}
     all_extensions = get_all_extensions()
     count = 1
@@ -83,6 +274,14 @@ def get_all_by_license():
 
     return dict(sorted(extensions_by_license.items()))
 
+def get_tsv_row(e):
+    row = [e['name'], e['namespace'], len(e['allVersions']), e['publishedBy']['loginName'],
+           e['publishedBy'].get('fullName', 'None'), e.get('license', 'None'), e['timestamp'],
+           e['downloadCount'], e['reviewCount'], len(e['files']),
+           e['preRelease'], e['verified'], e['unrelatedPublisher'], e['namespaceAccess'], e['preview'],
+           e.get('homepage', 'None'), e.get('repository', 'None'), e.get('bugs', 'None'), len(e['dependencies'])]
+    return '\t'.join(map(str, row)) + '\n'
+
 def write_json_file(extensions):
     f = open(JSON_FILENAME, 'w')
     f.write(json.dumps(extensions, indent=4))
@@ -90,20 +289,72 @@ def write_json_file(extensions):
 
 def write_tsv_file(extensions):
     f = open(TSV_FILENAME, 'w')
-    columns = "Name\tNamespace\tVersions\tLogin Name\t"
-    columns = columns + "Full Name\tLicense\tTimestamp\tDownloads\tReviews\tFiles\t"
-    columns = columns + "PreRelease\tVerified\tUnrelated Publisher\tNamespace Access\tPreview\t"
-    columns = columns + "Homepage\tRepo\tBugs\tBundled Extensions\n"
-    f.write(columns)
+    f.write('\t'.join(TSV_COLUMNS) + '\n')
     for e in extensions:
-        row = "%s\t%s\t%s\t%s" % (e['name'], e['namespace'], len(e['allVersions']), e['publishedBy']['loginName'])
-        row = "%s\t%s\t%s\t%s\t%s\t%s\t%s" % (row, e['publishedBy'].get('fullName', 'None'), e.get('license', 'None'), e['timestamp'], e['downloadCount'], e['reviewCount'], len(e['files']))
-        row = "%s\t%s\t%s\t%s\t%s\t%s" % (row, e['preRelease'], e['verified'], e['unrelatedPublisher'], e['namespaceAccess'], e['preview'])
-        row = "%s\t%s\t%s\t%s\t%s\n" % (row, e.get('homepage', 'None'), e.get('repository', 'None'), e.get('bugs', 'None'), len(e['dependencies']))
-        f.write(row)
+        f.write(get_tsv_row(e))
     f.close()
 
+def write_extension_files(extensions, ndjson_filename=NDJSON_FILENAME, tsv_filename=TSV_FILENAME, parquet_filename=None):
+    """Writes each extension to the NDJSON, TSV and optional Parquet files as soon as it is produced."""
+    parquet_writer = None
+    if parquet_filename is not None:
+        import columnar
+        parquet_writer = columnar.ParquetRowWriter(parquet_filename, columnar.EXTENSION_SCHEMA)
+    try:
+        with open(ndjson_filename, 'w') as ndjson_file, open(tsv_filename, 'w') as tsv_file:
+            tsv_file.write('\t'.join(TSV_COLUMNS) + '\n')
+            for e in extensions:
+                ndjson_file.write(json.dumps(e) + '\n')
+                tsv_file.write(get_tsv_row(e))
+                if parquet_writer is not None:
+                    parquet_writer.write(columnar.get_extension_row(e))
+    finally:
+        if parquet_writer is not None:
+            parquet_writer.close()
+
+def read_ndjson_file(filename=NDJSON_FILENAME):
+    with open(filename) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def collect(resume=False):
+    """Crawls the catalog and writes the output files, see the __main__ block."""
+    journal = checkpoint.Journal(JOURNAL_FILENAME, resume)
+    write_extension_files(iter_all_extensions(journal=journal), parquet_filename=PARQUET_FILENAME if OUTPUT_PARQUET else None)
+    journal.complete()
+    if EXTENSION_STORE:
+        store = extension_store.ExtensionStore(EXTENSION_STORE)
+        store.load(NDJSON_FILENAME)
+        store.close()
+
+def get_snapshot_filename(snapshot_dir=SNAPSHOT_DIR):
+    return os.path.join(snapshot_dir, 'extensions-%s.ndjson' % datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ'))
+
+def collect_summary(fields=(), snapshot_dir=SNAPSHOT_DIR):
+    """
+    Writes a time-stamped NDJSON snapshot built from the search pages, see
+    iter_summary_extensions, and returns its file name. The file only appears once complete.
+    """
+    filename = get_snapshot_filename(snapshot_dir)
+    os.makedirs(snapshot_dir, exist_ok=True)
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as f:
+        for e in iter_summary_extensions(fields):
+            f.write(json.dumps(e) + '\n')
+    os.replace(tmp_filename, filename)
+    print('Wrote %s' % filename)
+    return filename
+
 if __name__ == '__main__':
-    extensions = get_all_extensions()
-    write_json_file(extensions)
-    write_tsv_file(extensions)
+    parser = argparse.ArgumentParser(description='Collect metadata on all published extensions.')
+    parser.add_argument('--resume', action='store_true', help='continue an interrupted run from %s' % JOURNAL_FILENAME)
+    parser.add_argument('--summary', action='store_true',
+                        help='only read the search pages and write a time-stamped snapshot to %s' % SNAPSHOT_DIR)
+    parser.add_argument('--fields', default='',
+                        help='comma-separated extension detail fields to add to each --summary entry, e.g. license,publishedBy')
+    args = parser.parse_args()
+    if args.summary:
+        collect_summary([field for field in args.fields.split(',') if field])
+    else:
+        collect(args.resume)
@@ -2,36 +2,95 @@
 Script to collect availability data from open-vsx endpoints monitored by
 betteruptime. Used by graph_availability_trends Jupyter Notebook.Requires
 an access token from IT team.
+
+numpy is imported by the functions that need it, so plain collection runs start quickly.
 """
-import requests
-from datetime import datetime, timedelta
-import numpy as np
+from datetime import date, datetime, timedelta
 import os
 import calendar
-import time
-from urllib.parse import urlparse
+import json
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlparse
+import http_client
+import metrics
 
-API_URL = 'https://betteruptime.com/api/v2'
+API_URL = os.getenv('BETTER_STACK_API_URL', 'https://betteruptime.com/api/v2')
 TOKEN = os.getenv('TOKEN')
 HEADERS = {'Authorization': 'Bearer %s' % TOKEN}
+SECONDS_PER_DAY = 24 * 60 * 60
 
-def make_api_call(url):
-    # print("Calling %s" % url)
-    retry_count = 5
-    done = False
-    while not done:
+# Derive the rolling SLA from one downtime query per day instead of querying every window
+COMPUTE_LOCALLY = os.getenv('COMPUTE_LOCALLY', 'false').lower() == 'true'
+
+# SLA responses for windows that ended before today never change, so they are kept here
+# across runs. Set CACHE_FILE to an empty string to disable the persistent cache.
+CACHE_FILE = os.getenv('CACHE_FILE', 'availability_cache.sqlite')
+
+# Monitors are processed in parallel, sharing a single cap on requests per second
+MONITOR_WORKERS = int(os.getenv('MONITOR_WORKERS', '4'))
+MAX_REQUESTS_PER_SECOND = float(os.getenv('MAX_REQUESTS_PER_SECOND', '2'))
+http_client.set_rate_limit(urlparse(API_URL).hostname, MAX_REQUESTS_PER_SECOND)
+
+# Closed days and months are appended here and only newer rows are requested, see
+# availability_history.py. Set HISTORY_DIR to an empty string to always collect everything.
+HISTORY_DIR = os.getenv('HISTORY_DIR', 'availability_history')
+
+run_cache = {}
+cache_lock = threading.Lock()
+
+def is_closed_window(url):
+    to_date = parse_qs(urlparse(url).query).get('to')
+    return to_date is not None and to_date[0] < date.today().strftime('%Y-%m-%d')
+
+def open_cache():
+    connection = sqlite3.connect(CACHE_FILE)
+    connection.execute('CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, body TEXT NOT NULL)')
+    return connection
+
+def read_cached_response(url):
+    with cache_lock:
+        connection = open_cache()
         try:
-            response = requests.get(url, headers=HEADERS)
-            response.raise_for_status()
-            done = True
-        except requests.exceptions.RequestException as e:
-            if retry_count > 0:
-                print(" %s, retrying..." % e)
-                time.sleep((6 - retry_count) * 5)
-                retry_count = retry_count - 1
-            else:
-                raise
+            row = connection.execute('SELECT body FROM responses WHERE url = ?', (url,)).fetchone()
+        finally:
+            connection.close()
+    return None if row is None else json.loads(row[0])
+
+def write_cached_response(url, json_results):
+    with cache_lock:
+        connection = open_cache()
+        try:
+            with connection:
+                connection.execute('INSERT OR REPLACE INTO responses (url, body) VALUES (?, ?)', (url, json.dumps(json_results)))
+        finally:
+            connection.close()
+
+def make_api_call(url):
+    """
+    Returns the JSON response for url. SLA windows that are fully in the past never change, so
+    they are answered from memory when repeated and from the persistent cache across runs.
+    Open windows and the monitor list are always requested, so calling the collectors again in
+    a long-lived notebook kernel returns current values.
+    """
+    closed = is_closed_window(url)
+    if closed and url in run_cache:
+        return run_cache[url]
+    persistent = CACHE_FILE != '' and closed
+    json_results = read_cached_response(url) if persistent else None
+    if json_results is None:
+        json_results = request_api_call(url)
+        if persistent:
+            write_cached_response(url, json_results)
+    if closed:
+        run_cache[url] = json_results
+    return json_results
 
+def request_api_call(url):
+    # print("Calling %s" % url)
+    response = http_client.get(url, headers=HEADERS)
+    response.raise_for_status()
     return response.json()
 
 def get_all_monitors():
@@ -54,11 +113,18 @@ def get_all_monitors():
 def get_monitor_url(id, start_date, end_date):
     return '%s/monitors/%s/sla?from=%s&to=%s' % (API_URL, id, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
 
-def get_monitor_data(monitor, time_span):
+def get_first_window_start(monitor, time_span, after):
+    """Start of the first time_span window to collect, so that it ends the day after after."""
+    start_date = datetime.strptime(monitor['attributes']['created_at'][0:10], '%Y-%m-%d')
+    if after is not None:
+        start_date = max(start_date, after + timedelta(days=1 - time_span))
+    return start_date
+
+def get_monitor_data(monitor, time_span, after=None):
+    import numpy as np
     monitor_id = monitor['id']
     name = monitor['attributes']['pronounceable_name']
-    date_str = monitor['attributes']['created_at']
-    start_date = datetime.strptime(date_str[0:10], '%Y-%m-%d')
+    start_date = get_first_window_start(monitor, time_span, after)
     end_date = start_date + timedelta(days=time_span)
     today = datetime.now()
     dates = []
@@ -75,25 +141,95 @@ def get_monitor_data(monitor, time_span):
         downtime_data.append(json_results['data']['attributes']['total_downtime']/60)
         start_date = start_date + timedelta(days=1)
         end_date = end_date + timedelta(days=1)
+    metrics.count_items('availability', len(dates))
     print('finished processing')
     return name, dates, sla_data, downtime_data
 
-def get_continuous_data(time_span=30):
+def get_daily_downtime(monitor_id, start_date, days):
+    import numpy as np
+    downtime = np.zeros(days)
+    for i in range(days):
+        day = start_date + timedelta(days=i)
+        json_results = make_api_call(get_monitor_url(monitor_id, day, day))
+        downtime[i] = json_results['data']['attributes']['total_downtime']
+    return downtime
+
+def get_local_monitor_data(monitor, time_span, after=None):
+    """
+    Same series as get_monitor_data, but the availability of each window is computed from
+    per-day downtime with a cumulative sum rather than asking the API for every window.
+    Each window covers time_span + 1 whole days, matching the inclusive from/to of the SLA query.
+    """
+    import numpy as np
+    monitor_id = monitor['id']
+    name = monitor['attributes']['pronounceable_name']
+    start_date = get_first_window_start(monitor, time_span, after)
+    today = datetime.now()
+    windows = max((today - start_date).days - time_span + 1, 0)
+    print('processing %s' % name)
+    downtime = get_daily_downtime(monitor_id, start_date, windows + time_span if windows > 0 else 0)
+    cumulative_downtime = np.concatenate(([0.0], np.cumsum(downtime)))
+    window_downtime = cumulative_downtime[time_span + 1:time_span + 1 + windows] - cumulative_downtime[:windows]
+    sla = 100 * (1 - window_downtime / ((time_span + 1) * SECONDS_PER_DAY))
+    dates = np.datetime64(start_date.strftime('%Y-%m-%d')) + time_span + np.arange(windows)
+    metrics.count_items('availability', len(dates))
+    print('finished processing')
+    return name, list(dates), sla.tolist(), (downtime[:windows] / 60).tolist()
+
+def get_stored_monitor_data(monitor, kind, get_data, unit):
+    """
+    Returns the monitor's series from the on-disk history plus whatever get_data(after) collects
+    after the last stored date. Each row is dated by the day or month (unit) its window ends in.
+    Only rows whose window had already ended before collection started are appended to the
+    history; rows for the still-open day or month are recomputed on every run.
+    """
+    import numpy as np
+    import availability_history
+    # Taken before collecting, so a window that closes while the run is in progress is not stored
+    closed_before = np.datetime64(date.today()).astype(unit)
+    history = availability_history.read_history(monitor['id'], kind)
+    after = None
+    if len(history) > 0:
+        after = datetime.combine(history['date'][-1].astype(date), datetime.min.time())
+    name, dates, sla_data, downtime_data = get_data(after)
+    closed = sum(1 for d in dates if d < closed_before)
+    availability_history.append_history(monitor['id'], kind, dates[:closed], sla_data[:closed], downtime_data[:closed])
+    return (name,
+            list(history['date'].astype(unit)) + dates,
+            history['availability'].tolist() + sla_data,
+            history['downtime'].tolist() + downtime_data)
+
+def get_continuous_data(time_span=30, compute_locally=COMPUTE_LOCALLY, max_workers=MONITOR_WORKERS):
     monitors = get_all_monitors()
+    get_data = get_local_monitor_data if compute_locally else get_monitor_data
+
+    def get_monitor_series(monitor):
+        if not HISTORY_DIR:
+            return get_data(monitor, time_span)
+        # Locally computed and API-reported SLA values are kept in separate series
+        kind = ('daily-local-%s' if compute_locally else 'daily-%s') % time_span
+        return get_stored_monitor_data(monitor, kind, lambda after: get_data(monitor, time_span, after), 'datetime64[D]')
+
     results = []
-    for monitor in monitors:
-        name, dates, sla_data, downtime_data = get_monitor_data(monitor, time_span)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # map() returns results in monitor order regardless of which monitor finishes first
+        monitor_data = list(executor.map(get_monitor_series, monitors))
+    for name, dates, sla_data, downtime_data in monitor_data:
         results.append({'name': name,
                         'dates': dates,
                         'sla_data': sla_data,
                         'downtime_data': downtime_data})
     return results
 
-def get_monthly_monitor_data(monitor):
+def get_monthly_monitor_data(monitor, after=None):
+    import numpy as np
     monitor_id = monitor['id']
     name = monitor['attributes']['pronounceable_name']
     date_str = monitor['attributes']['created_at']
     interval_start_date = datetime.strptime(date_str[0:10], '%Y-%m-%d')
+    if after is not None:
+        # Continue with the month following the last one already collected
+        interval_start_date = max(interval_start_date, (after.replace(day=1) + timedelta(days=32)).replace(day=1))
     end_date = datetime.now()
     dates = []
     sla_data = []
@@ -107,19 +243,26 @@ def get_monthly_monitor_data(monitor):
         dt = interval_start_date.strftime('%Y-%m')
         dates.append(np.datetime64(dt))
         sla_data.append(json_results['data']['attributes']['availability'])
-        downtime_url = get_monitor_url(monitor_id, interval_start_date, interval_end_date)
-        json_results = make_api_call(downtime_url)
+        # The same response carries both the availability and the downtime for the month
         downtime_data.append(json_results['data']['attributes']['total_downtime']/60)
         interval_start_date = interval_end_date + timedelta(days=1)
 
+    metrics.count_items('availability', len(dates))
     print('finished processing')
     return name, dates, sla_data, downtime_data
 
-def get_monthly_data():
+def get_monthly_data(max_workers=MONITOR_WORKERS):
     monitors = get_all_monitors()
+
+    def get_monitor_series(monitor):
+        if not HISTORY_DIR:
+            return get_monthly_monitor_data(monitor)
+        return get_stored_monitor_data(monitor, 'monthly', lambda after: get_monthly_monitor_data(monitor, after), 'datetime64[M]')
+
     results = []
-    for monitor in monitors:
-        name, dates, sla_data, downtime_data = get_monthly_monitor_data(monitor)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        monitor_data = list(executor.map(get_monitor_series, monitors))
+    for name, dates, sla_data, downtime_data in monitor_data:
         results.append({'name': name,
                         'dates': dates,
                         'sla_data': sla_data,
@@ -7,25 +7,43 @@ web auth, not the API token:
 
 Currently there is a bug in stats that requires a token query paramater, the value of
 which is ignored.
+
+pandas is imported by the functions that build DataFrames, so collecting the reports alone
+does not pay for it.
 """
 
-import requests
-from requests.auth import HTTPBasicAuth
+import argparse
 from datetime import date
 from dateutil.relativedelta import relativedelta
-import pandas as pd
 import os
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from json import JSONDecodeError
+import http_client
+import metrics
 
 API_ENDPOINT = os.getenv('API_ENDPOINT')
 ACCESS_TOKEN = os.getenv('ACCESS_TOKEN')
 
+# Monthly admin reports are stored here once retrieved; a closed month's report never changes
+REPORT_DIR = os.getenv('REPORT_DIR', 'admin_reports')
+REPORT_WORKERS = int(os.getenv('REPORT_WORKERS', '4'))
+
+# Backfill mode schedules the reports the server has not generated yet and waits for them,
+# polling every BACKFILL_POLL_INTERVAL seconds, doubling up to BACKFILL_MAX_INTERVAL
+BACKFILL = os.getenv('BACKFILL', 'false').lower() == 'true'
+BACKFILL_POLL_INTERVAL = float(os.getenv('BACKFILL_POLL_INTERVAL', '10'))
+BACKFILL_MAX_INTERVAL = float(os.getenv('BACKFILL_MAX_INTERVAL', '300'))
+BACKFILL_TIMEOUT = float(os.getenv('BACKFILL_TIMEOUT', '3600'))
+
+TOP_PROPS = ['topMostActivePublishingUsers', 'topNamespaceExtensions', 'topNamespaceExtensionVersions', 'topMostDownloadedExtensions']
+
 HEADERS = ['year', 'month', 'extensions', 'downloads', 'downloadsTotal', 'publishers', 'averageReviewsPerExtension', 'namespaceOwners']
 
 def get_available_reports():
     url = '%sadmin/reports?token=%s' % (API_ENDPOINT, ACCESS_TOKEN)
-    response = requests.get(url)
+    response = http_client.get(url)
     results = response.json()
     return results
 
@@ -36,69 +54,150 @@ def schedule_report(year, month):
         'year': year,
         'month': month
     }
-    response = requests.post(url, headers=headers, data=json.dumps(payload))
+    response = http_client.post(url, headers=headers, data=json.dumps(payload))
     return response.status_code
 
 
-def get_publishing_data(starting_year, starting_month):
+def get_report_months(starting_year, starting_month):
+    """Returns (year, month) for every closed month from the starting month up to last month."""
     start_date = date(starting_year, starting_month, 1)
     today = date.today()
+    months = []
+    while start_date.year < today.year or (start_date.year == today.year and start_date.month < today.month):
+        months.append((start_date.year, start_date.month))
+        start_date = start_date + relativedelta(months=1)
+    return months
+
+def get_report_path(year, month):
+    return os.path.join(REPORT_DIR, '%s-%02d.json' % (year, month))
+
+def read_stored_report(year, month):
+    try:
+        with open(get_report_path(year, month)) as f:
+            return json.load(f)
+    except (OSError, JSONDecodeError):
+        return None
+
+def store_report(year, month, json_results):
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    path = get_report_path(year, month)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(json_results, f)
+    os.replace(tmp_path, path)
+
+def fetch_report(year, month):
+    url = '%sadmin/report?year=%s&month=%s&token=%s' % (API_ENDPOINT, year, month, ACCESS_TOKEN)
+    response = http_client.get(url)
+    if response.status_code != 200:
+        print("%s error processing results for %s" % (response.status_code, url))
+        return None
+    try:
+        json_results = response.json()
+    except JSONDecodeError:
+        print("Error decoding JSON results for %s" % url)
+        return None
+    store_report(year, month, json_results)
+    metrics.count_items('admin_reports')
+    return json_results
+
+def get_available_months():
+    reports = get_available_reports()
+    return {(int(year), int(month)) for year in reports for month in reports[year]}
+
+def backfill_reports(months, max_workers=REPORT_WORKERS):
+    """
+    Schedules a report for each of months the server has not generated yet, then polls the
+    available reports with a growing interval and fetches each report as soon as it is ready.
+    Returns {(year, month): report} for the months retrieved within BACKFILL_TIMEOUT.
+    """
+    available = get_available_months()
+    waiting = list(months)
+    reports = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        unscheduled = [month for month in months if month not in available]
+        if unscheduled:
+            print('Scheduling reports for %s months' % len(unscheduled))
+        for month, status_code in zip(unscheduled, executor.map(lambda month: schedule_report(*month), unscheduled)):
+            if status_code >= 400:
+                print('%s error scheduling report for %s-%s' % (status_code, *month))
+                waiting.remove(month)
+
+        interval = BACKFILL_POLL_INTERVAL
+        deadline = time.monotonic() + BACKFILL_TIMEOUT
+        while True:
+            ready = [month for month in waiting if month in available]
+            waiting = [month for month in waiting if month not in available]
+            for month, json_results in zip(ready, executor.map(lambda month: fetch_report(*month), ready)):
+                if json_results is not None:
+                    reports[month] = json_results
+            if not waiting or time.monotonic() + interval > deadline:
+                break
+            print('Waiting %ss for %s reports' % (interval, len(waiting)))
+            time.sleep(interval)
+            interval = min(interval * 2, BACKFILL_MAX_INTERVAL)
+            available = get_available_months()
+    if waiting:
+        print('Gave up waiting for reports for %s' % ', '.join('%s-%s' % month for month in waiting))
+    return reports
+
+def get_reports(starting_year, starting_month, max_workers=REPORT_WORKERS, backfill=BACKFILL):
+    """
+    Returns [(year, month, report)] for every closed month from the starting month, in order.
+    Reports already in REPORT_DIR are read from disk and only the missing months are requested,
+    concurrently. With backfill, reports the server has not generated yet are scheduled and
+    waited for, see backfill_reports. report is None for months the server could not provide.
+    """
+    months = get_report_months(starting_year, starting_month)
+    reports = {month: read_stored_report(*month) for month in months}
+    missing = [month for month in months if reports[month] is None]
+    if backfill:
+        reports.update(backfill_reports(missing, max_workers))
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for month, json_results in zip(missing, executor.map(lambda month: fetch_report(*month), missing)):
+                reports[month] = json_results
+    return [(year, month, reports[(year, month)]) for year, month in months]
+
+def get_publishing_data(starting_year, starting_month, backfill=BACKFILL):
+    import pandas as pd
     data = {}
     for header in HEADERS:
         data[header] = []
-    while start_date.year < today.year or (start_date.year == today.year and start_date.month < today.month):
-        url = '%sadmin/report?year=%s&month=%s&token=%s' % (API_ENDPOINT, start_date.year, start_date.month, ACCESS_TOKEN)
-        response = requests.get(url)
-        if response.status_code == 200:
-            try:
-                json_results = response.json()
-                for col in HEADERS:
-                    data[col].append(json_results[col])
-                print("processed results for %s-%s" % (start_date.year, start_date.month))
-            except JSONDecodeError:
-                json_results = None
-                print("Error decoding JSON results for %s" % url)
-        else:
-            print("%s error processing results for %s" % (response.status_code, url))
-        start_date = start_date + relativedelta(months=1)
+    for year, month, json_results in get_reports(starting_year, starting_month, backfill=backfill):
+        if json_results is not None:
+            for col in HEADERS:
+                data[col].append(json_results[col])
+            print("processed results for %s-%s" % (year, month))
 
     df = pd.DataFrame(data,columns=HEADERS)
     return df
 
 def process_most_active_data(most_active):
+    """
+    Pivots the long (date, category, key, value) records into one frame per category, with a
+    column per key in order of first appearance, a row per date and None/NaN where a key was
+    not in that month's top list.
+    """
+    import numpy as np
+    import pandas as pd
+    dates = most_active['dates']
+    records = pd.DataFrame(most_active['records'], columns=['date', 'category', 'key', 'value'], dtype=object)
     resulting_dfs = {}
-    for key in most_active.keys():
-        if key == 'dates':
-            dates = most_active['dates']
-        else:
-            data = {'dates': dates}
-            for entry in most_active[key]['unique']:
-                data[entry] = [None] * len(most_active['dates'])
-            for i in range(len(dates)):
-                date = dates[i]
-                for entry in most_active[key][date]:
-                    item = list(entry.values())[0]
-                    value = list(entry.values())[1]
-                    data[item][i] = value
-            df = pd.DataFrame(data, columns=most_active[key]['unique'])
-            df['date'] = dates
-            resulting_dfs[key] = df
+    for category in TOP_PROPS:
+        rows = records[records['category'] == category].drop_duplicates(['date', 'key'], keep='last')
+        columns = pd.unique(records.loc[records['category'] == category, 'key'])
+        values = np.full((len(columns), len(dates)), None, dtype=object)
+        values[pd.Index(columns).get_indexer(rows['key']), rows['date'].to_numpy(dtype=int)] = rows['value'].to_numpy()
+        # Lists of plain Python values give pandas the same dtype inference as building the columns by hand
+        df = pd.DataFrame(dict(zip(columns, values.tolist())), columns=columns)
+        df['date'] = dates
+        resulting_dfs[category] = df
     return resulting_dfs
 
-def most_active_data_append_unique(most_active, json_results, top_prop, key):
-    for item in json_results[top_prop]:
-        if item[key] not in most_active[top_prop]['unique']:
-            most_active[top_prop]['unique'].append(item[key])
-
 def extract_most_active_data_from_json(most_active, json_results, year, month):
-    top_publishers = 'topMostActivePublishingUsers'
-    top_extensions = 'topNamespaceExtensions'
-    top_extension_versions = 'topNamespaceExtensionVersions'
-    top_downloads = 'topMostDownloadedExtensions'
-
     no_data = True
-    top_props = [top_publishers, top_extensions, top_extension_versions, top_downloads]
-    for top_prop in top_props:
+    for top_prop in TOP_PROPS:
         if len(json_results[top_prop]) > 0:
             no_data = False
             break
@@ -107,66 +206,52 @@ def extract_most_active_data_from_json(most_active, json_results, year, month):
         return
 
     year_month = '%s/%s' % (month, str(year)[2:])
+    date_index = len(most_active['dates'])
     most_active['dates'].append(year_month)
 
-    most_active[top_publishers][year_month] = json_results[top_publishers]
-    most_active_data_append_unique(most_active, json_results, top_publishers, 'userLoginName')
-
-    most_active[top_extensions][year_month] = json_results[top_extensions]
-    most_active_data_append_unique(most_active, json_results, top_extensions, 'namespace')
-
-    most_active[top_extension_versions][year_month] = json_results[top_extension_versions]
-    most_active_data_append_unique(most_active, json_results, top_extension_versions, 'namespace')
-
-    most_active[top_downloads][year_month] = json_results[top_downloads]
-    most_active_data_append_unique(most_active, json_results, top_downloads, 'extensionIdentifier')
+    for top_prop in TOP_PROPS:
+        for entry in json_results[top_prop]:
+            # Each entry is {<name property>: name, <count property>: count}
+            item, value = list(entry.values())[:2]
+            most_active['records'].append((date_index, top_prop, item, value))
 
-def get_most_active_data(starting_year, starting_month):
+def get_most_active_data(starting_year, starting_month, backfill=BACKFILL):
     most_active = {
         'dates': [],
-        'topMostActivePublishingUsers': {
-            'unique': []
-        },
-        'topNamespaceExtensions': {
-            'unique': []
-        },
-        'topNamespaceExtensionVersions': {
-            'unique': []
-        },
-        'topMostDownloadedExtensions': {
-            'unique': []
-        }
+        'records': []
     }
 
-    today = date.today()
-    start_date = date(starting_year, starting_month, 1)
-    while start_date.year < today.year or (start_date.year == today.year and start_date.month < today.month):
-        url = '%sadmin/report?year=%s&month=%s&token=%s' % (API_ENDPOINT, start_date.year, start_date.month, ACCESS_TOKEN)
-        response = requests.get(url)
-        if response.status_code == 200:
-            try:
-                extract_most_active_data_from_json(most_active, response.json(), start_date.year, start_date.month)
-            except JSONDecodeError:
-                print("Error decoding JSON results for %s" % url)
-        else:
-            print("%s error processing results for %s" % (response.status_code, url))
-        start_date = start_date + relativedelta(months=1)
+    for year, month, json_results in get_reports(starting_year, starting_month, backfill=backfill):
+        if json_results is not None:
+            extract_most_active_data_from_json(most_active, json_results, year, month)
 
     return process_most_active_data(most_active)
 
-if __name__ == '__main__':
-    reports = get_available_reports()
+def get_starting_month():
+    """Returns STARTING_YEAR/STARTING_MONTH, or the first month with a report when they are not set."""
     starting_year = os.getenv('STARTING_YEAR', None)
     starting_month = os.getenv('STARTING_MONTH', None)
     if starting_year is None or starting_month is None:
+        reports = get_available_reports()
         year = list(reports.keys())[0]
         starting_year = int(year)
         starting_month = int(reports[year][0])
     else:
         starting_year = int(starting_year)
         starting_month = int(starting_month)
+    return starting_year, starting_month
 
-    most_active_dfs = get_most_active_data(starting_year, starting_month)
+def collect(backfill=BACKFILL):
+    """Brings the local report store up to date without building any DataFrames."""
+    return get_reports(*get_starting_month(), backfill=backfill)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Collect monthly admin reports.')
+    parser.add_argument('--backfill', action='store_true', default=BACKFILL,
+                        help='schedule reports that have not been generated yet and wait for them')
+    args = parser.parse_args()
+    starting_year, starting_month = get_starting_month()
+    most_active_dfs = get_most_active_data(starting_year, starting_month, args.backfill)
     for key in most_active_dfs:
         print(key)
         dates = most_active_dfs[key]['date']
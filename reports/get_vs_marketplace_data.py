@@ -3,11 +3,91 @@ Script to collect metadata on all extensions published on VS Code Marketplace. O
 both a JSON and a CSV file. Note, this relies on interfaces that are not fully documented
 and are subject to change.
 """
+import argparse
+import copy
 import os
-import requests
+import sys
 import json
 import traceback
-from datetime import datetime
+import checkpoint
+import get_all_extensions
+import http_client
+import metrics
+import pagination
+
+CSV_FILE_NAME = 'all_vs_extensions.csv'
+JSON_FILE_NAME = 'all_vs_extensions.json'
+PARQUET_FILE_NAME = 'all_vs_extensions.parquet'
+JOURNAL_FILE_NAME = 'all_vs_extensions.journal'
+MS_API_URL = os.getenv('MS_API_URL', 'https://marketplace.visualstudio.com/_apis/public/gallery/extensionquery')
+MS_HEADERS = {
+    'content-type': 'application/json',
+    'accept': 'application/json;api-version=3.0-preview.1',
+    'accept-encoding': 'gzip'
+}
+
+# Looks like 1000 is the max page size
+MS_PAGE_SIZE = 1000
+MS_QUERY_PAYLOAD = {
+        "assetTypes": [
+            "Microsoft.VisualStudio.Services.Icons.Default",
+            "Microsoft.VisualStudio.Services.Icons.Branding",
+            "Microsoft.VisualStudio.Services.Icons.Small"
+        ],
+        "filters": [
+            {
+            "criteria": [
+                {
+                "filterType": 8,
+                "value": "Microsoft.VisualStudio.Code"
+                },
+                {
+                "filterType": 10,
+                "value": "target:\"Microsoft.VisualStudio.Code\" "
+                },
+                {
+                "filterType": 12,
+                "value": "37888"
+                }
+            ],
+            "direction": 2,
+            "pageSize": MS_PAGE_SIZE,
+            "pageNumber": 1,
+            "sortBy": 4,
+            "sortOrder": 0,
+            "pagingToken": None
+            }
+        ],
+        "flags": 870
+    }
+
+# Lean mode asks only for what write_csv_file uses: the latest version with its properties,
+# and no files, tags, installation targets, statistics or icon assets. The flags are
+# IncludeVersions (0x1), IncludeVersionProperties (0x10), ExcludeNonValidated (0x20) and
+# IncludeLatestVersionOnly (0x200). Pages are reduced to compact records as they are parsed,
+# incrementally if ijson is installed.
+LEAN = os.getenv('LEAN', 'false').lower() == 'true'
+LEAN_QUERY_PAYLOAD = {key: value for key, value in MS_QUERY_PAYLOAD.items() if key != 'assetTypes'}
+LEAN_QUERY_PAYLOAD['flags'] = 0x1 | 0x10 | 0x20 | 0x200
+
+SOURCE_PROPERTY = 'Microsoft.VisualStudio.Services.Links.Source'
+PRICING_PROPERTY = 'Microsoft.VisualStudio.Services.Content.Pricing'
+MS_PROPERTIES = {SOURCE_PROPERTY, PRICING_PROPERTY}
+
+# Optional extensions.ndjson written by get_all_extensions.py. When set, the Open VSX side of the
+# comparison is read from it instead of the search API, and no detail requests are needed.
+VSX_SNAPSHOT = os.getenv('VSX_SNAPSHOT')
+
+# Also write the comparison as a Parquet file (requires pyarrow), see columnar.py
+OUTPUT_PARQUET = os.getenv('OUTPUT_PARQUET', 'false').lower() == 'true'
+
+def get_ms_properties(version):
+    """Returns the MS_PROPERTIES values of version in a single pass over its properties."""
+    properties = {}
+    for prop in version.get('properties') or ():
+        if prop['key'] in MS_PROPERTIES and prop['key'] not in properties:
+            properties[prop['key']] = prop['value']
+    return properties
 
 def get_ms_info(ext):
     extension_name = ext['extensionName']
@@ -16,135 +96,235 @@ def get_ms_info(ext):
     latest_version = ext['versions'][0]['version']
     last_updated = ext['versions'][0]['lastUpdated']
 
-    try:
-        repo = [prop for prop in ext['versions'][0]['properties'] if prop['key'] == 'Microsoft.VisualStudio.Services.Links.Source'][0]['value']
-    except Exception:
-        repo = None
-
-    try:
-        pricing = [prop for prop in ext['versions'][0]['properties'] if prop['key'] == 'Microsoft.VisualStudio.Services.Content.Pricing'][0]['value']
-    except Exception:
-        pricing = None
+    properties = get_ms_properties(ext['versions'][0])
+    repo = properties.get(SOURCE_PROPERTY)
+    pricing = properties.get(PRICING_PROPERTY)
 
     return extension_name, publisher_name, display_name, latest_version, last_updated, repo, pricing
 
 def convert_date_str(input_str):
-    date_str = input_str[0:input_str.find('T')]
-    date = datetime.strptime(date_str, '%Y-%m-%d')
-    return_str = date.strftime("%-m/%-d/%Y")
-    return return_str
+    # 2024-03-09T12:00:00Z -> 3/9/2024
+    year, month, day = input_str.split('T')[0].split('-')
+    return '%d/%d/%s' % (int(month), int(day), year)
+
+def get_compact_extension(ext):
+    """Reduces a Marketplace extension to the fields get_ms_info reads."""
+    version = ext['versions'][0]
+    return {
+        'extensionName': ext['extensionName'],
+        'displayName': ext['displayName'],
+        'publisher': {'publisherName': ext['publisher']['publisherName']},
+        'versions': [{
+            'version': version['version'],
+            'lastUpdated': version['lastUpdated'],
+            'properties': [{'key': key, 'value': value} for key, value in get_ms_properties(version).items()]
+        }]
+    }
+
+def get_ms_page(index):
+    payload = copy.deepcopy(MS_QUERY_PAYLOAD)
+    payload['filters'][0]['pageNumber'] = index + 1
+    response = http_client.post(MS_API_URL, headers=MS_HEADERS, data=json.dumps(payload))
+    if response.status_code != 200:
+        print('HTTP %s error' % response.status_code)
+    response.raise_for_status()
+    vsx_results = response.json()
+    extensions = vsx_results['results'][0]['extensions']
+    total = vsx_results['results'][0]['resultMetadata'][0]['metadataItems'][0]['count']
+    return extensions, total
+
+def parse_lean_page(stream):
+    """
+    Parses an extensionquery response from stream with ijson, keeping only a compact record
+    of each extension, so the decoded page is never held in memory as a whole.
+    """
+    import ijson
+    extensions = []
+    total = None
+    builder = None
+    for prefix, event, value in ijson.parse(stream):
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == 'results.item.extensions.item' and event == 'end_map':
+                extensions.append(get_compact_extension(builder.value))
+                builder = None
+        elif prefix == 'results.item.extensions.item' and event == 'start_map':
+            builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+        elif prefix == 'results.item.resultMetadata.item.metadataItems.item.count' and total is None:
+            total = int(value)
+    return extensions, total
+
+def get_lean_ms_page(index):
+    payload = copy.deepcopy(LEAN_QUERY_PAYLOAD)
+    payload['filters'][0]['pageNumber'] = index + 1
+    try:
+        import ijson
+    except ImportError:
+        ijson = None
+    response = http_client.post(MS_API_URL, headers=MS_HEADERS, data=json.dumps(payload), stream=ijson is not None)
+    if response.status_code != 200:
+        print('HTTP %s error' % response.status_code)
+    response.raise_for_status()
+    if ijson is None:
+        vsx_results = response.json()
+        extensions = [get_compact_extension(ext) for ext in vsx_results['results'][0]['extensions']]
+        return extensions, vsx_results['results'][0]['resultMetadata'][0]['metadataItems'][0]['count']
+    with response:
+        # Let urllib3 undo the gzip content encoding while ijson reads
+        response.raw.decode_content = True
+        return parse_lean_page(response.raw)
+
+def get_ms_extensions(journal=None, lean=LEAN):
+    all_extensions = []
+    total_all_versions = 0
+    get_page = get_lean_ms_page if lean else get_ms_page
+    # Lean pages hold compact records, so they are journaled apart from full pages
+    for extensions, total in pagination.iter_pages(get_page, MS_PAGE_SIZE, journal=journal, kind='ms-lean' if lean else 'ms'):
+        all_extensions.extend(extensions)
+        for extension in extensions:
+            versions = extension['versions']
+            total_all_versions += len(versions)
+        print('Retrieved %s of %s MS Marketplace extensions. %s total versions.' % (len(all_extensions), total, total_all_versions))
+
+    return all_extensions
+
+def normalize_repo_url(url):
+    if not url:
+        return None
+    url = url.strip().lower()
+    for prefix in ['git+', 'https://', 'http://', 'ssh://', 'git://', 'git@', 'www.']:
+        if url.startswith(prefix):
+            url = url[len(prefix):]
+    url = url.replace('github.com:', 'github.com/').rstrip('/')
+    if url.endswith('.git'):
+        url = url[:-len('.git')]
+    return url
+
+def build_vsx_index(vsx_extensions):
+    """
+    Indexes Open VSX extensions by lowercase namespace.name and by normalised repository URL.
+    A repository shared by several extensions is ambiguous and maps to None.
+    """
+    by_name = {}
+    by_repo = {}
+    for extension in vsx_extensions:
+        by_name['%s.%s' % (extension['namespace'].lower(), extension['name'].lower())] = extension
+        repo = normalize_repo_url(extension.get('repository'))
+        if repo is not None:
+            by_repo[repo] = None if repo in by_repo else extension
+    print('Indexed %s Open VSX extensions, %s repositories' % (len(by_name), len(by_repo)))
+    return by_name, by_repo
+
+def get_vsx_extensions(journal=None):
+    if VSX_SNAPSHOT:
+        return get_all_extensions.read_ndjson_file(VSX_SNAPSHOT)
+    return get_all_extensions.retrieve_extensions(journal)
+
+def find_vsx_extension(ext, by_name, by_repo):
+    ms_extension_name, ms_publisher_name, _, _, _, ms_repo, _ = get_ms_info(ext)
+    match = by_name.get('%s.%s' % (ms_publisher_name.lower(), ms_extension_name.lower()))
+    if match is None:
+        match = by_repo.get(normalize_repo_url(ms_repo))
+    return match
+
+def get_vsx_details(vsx_extension):
+    if vsx_extension is None:
+        return None
+    # Snapshot entries are already full documents, search entries need a detail request
+    if 'publishedBy' in vsx_extension:
+        return vsx_extension
+    return get_all_extensions.get_extension(vsx_extension)
+
+def write_csv_file(ms_extensions, by_name, by_repo, parquet_filename=None, journal=None):
+    def fetch(vsx_extension):
+        if vsx_extension is not None and journal is not None and journal.has_item(get_all_extensions.get_extension_key(vsx_extension)):
+            return journal.get_item(get_all_extensions.get_extension_key(vsx_extension))
+        return get_vsx_details(vsx_extension)
+
+    matches = (find_vsx_extension(ext, by_name, by_repo) for ext in ms_extensions)
+    vsx_details = get_all_extensions.iter_extension_details(matches, get_all_extensions.MAX_WORKERS, fetch)
+    parquet_writer = None
+    if parquet_filename is not None:
+        import columnar
+        parquet_writer = columnar.ParquetRowWriter(parquet_filename, columnar.MARKETPLACE_SCHEMA)
+    csv_file = open(CSV_FILE_NAME, 'w')
+    csv_file.write("MS Publisher (Namespace), MS Extension, MS DisplayName, MS Pricing, MS Version, MS Date, VSX Version, VSX Date, VSX Publisher, VSX License, Repo\n")
+    for ext, (vsx_extension, vsx_results) in zip(ms_extensions, vsx_details):
+        print("%s.%s" % (ext['publisher']['publisherName'], ext['extensionName']))
+        metrics.count_items('marketplace')
+        ms_extension_name, ms_publisher_name, ms_display_name, ms_latest_version, ms_last_updated, ms_repo, ms_pricing = get_ms_info(ext)
+        if vsx_results is not None:
+            if journal is not None:
+                journal.record_item(get_all_extensions.get_extension_key(vsx_extension), vsx_results)
+            csv_file.write("%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s\n" % (
+                            ms_publisher_name,
+                            ms_extension_name,
+                            ms_display_name,
+                            ms_pricing,
+                            ms_latest_version,
+                            convert_date_str(ms_last_updated),
+                            vsx_results['version'],
+                            convert_date_str(vsx_results['timestamp']),
+                            vsx_results['publishedBy']['loginName'],
+                            vsx_results.get('license', None),
+                            ms_repo
+                            ))
+            if parquet_writer is not None:
+                parquet_writer.write(columnar.get_marketplace_row(
+                    ms_publisher_name, ms_extension_name, ext['displayName'], ms_pricing, ms_latest_version, ms_last_updated,
+                    vsx_results['version'], vsx_results['timestamp'], vsx_results['publishedBy']['loginName'],
+                    vsx_results.get('license', None), ms_repo))
+        else:
+            if vsx_extension is not None:
+                print('Error retrieving %s' % vsx_extension['url'])
+            csv_file.write("%s, %s, %s, %s, %s, %s, , , , , %s\n" % (
+                    ms_publisher_name,
+                    ms_extension_name,
+                    ms_display_name,
+                    ms_pricing,
+                    ms_latest_version,
+                    convert_date_str(ms_last_updated),
+                    ms_repo
+                    ))
+            if parquet_writer is not None:
+                parquet_writer.write(columnar.get_marketplace_row(
+                    ms_publisher_name, ms_extension_name, ext['displayName'], ms_pricing, ms_latest_version, ms_last_updated,
+                    None, None, None, None, ms_repo))
+    csv_file.close()
+    if parquet_writer is not None:
+        parquet_writer.close()
+
+def write_json_file(ms_extensions, indent=4):
+    json_file = open(JSON_FILE_NAME, 'w')
+    # json.dump writes the document in chunks instead of building one large string first
+    json.dump(ms_extensions, json_file, indent=indent)
+    json_file.close()
+
+def collect(resume=False, lean=LEAN):
+    """Collects both catalogs and writes the output files, see the __main__ block."""
+    journal = checkpoint.Journal(JOURNAL_FILE_NAME, resume)
+    try:
+        all_extensions = get_ms_extensions(journal, lean)
+        by_name, by_repo = build_vsx_index(get_vsx_extensions(journal))
+        write_csv_file(all_extensions, by_name, by_repo, PARQUET_FILE_NAME if OUTPUT_PARQUET else None, journal)
+        write_json_file(all_extensions, None if lean else 4)
+    except Exception:
+        journal.close()
+        raise
+    journal.complete()
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Collect metadata on all extensions published on VS Code Marketplace.')
+    parser.add_argument('--resume', action='store_true', help='continue an interrupted run from %s' % JOURNAL_FILE_NAME)
+    parser.add_argument('--lean', action='store_true', default=LEAN,
+                        help='request only the latest version and keep compact records, see LEAN_QUERY_PAYLOAD')
+    args = parser.parse_args()
+
     try:
-        CSV_FILE_NAME = 'all_vs_extensions.csv'
-        JSON_FILE_NAME = 'all_vs_extensions.json'
-        MS_API_URL = 'https://marketplace.visualstudio.com/_apis/public/gallery/extensionquery'
-        MS_HEADERS = {
-            'content-type': 'application/json',
-            'accept': 'application/json;api-version=3.0-preview.1',
-            'accept-encoding': 'gzip'
-        }
-        API_ENDPOINT = os.environ['API_ENDPOINT']
-        VSX_API = '%sapi' % API_ENDPOINT
-
-        # Looks like 1000 is the max page size
-        get_all_extensions_payload = {
-                "assetTypes": [
-                    "Microsoft.VisualStudio.Services.Icons.Default",
-                    "Microsoft.VisualStudio.Services.Icons.Branding",
-                    "Microsoft.VisualStudio.Services.Icons.Small"
-                ],
-                "filters": [
-                    {
-                    "criteria": [
-                        {
-                        "filterType": 8,
-                        "value": "Microsoft.VisualStudio.Code"
-                        },
-                        {
-                        "filterType": 10,
-                        "value": "target:\"Microsoft.VisualStudio.Code\" "
-                        },
-                        {
-                        "filterType": 12,
-                        "value": "37888"
-                        }
-                    ],
-                    "direction": 2,
-                    "pageSize": 1000,
-                    "pageNumber": 1,
-                    "sortBy": 4,
-                    "sortOrder": 0,
-                    "pagingToken": None
-                    }
-                ],
-                "flags": 870
-            }
-        all_extensions = []
-        total_all_versions = 0
-        while True:
-            response = requests.post(MS_API_URL, headers=MS_HEADERS, data=json.dumps(get_all_extensions_payload))
-            if response.status_code != 200:
-                print('HTTP %s error' % response.status_code)
-                break
-            else:
-                vsx_results = response.json()
-                extensions = vsx_results['results'][0]['extensions']
-                all_extensions = all_extensions + extensions
-                for extension in extensions:
-                    versions = extension['versions']
-                    total_all_versions += len(versions)
-                total = vsx_results['results'][0]['resultMetadata'][0]['metadataItems'][0]['count']
-                print('Retrieved %s of %s MS Marketplace extensions. %s total versions.' % (len(all_extensions), total, total_all_versions))
-                if len(all_extensions) == total:
-                    break
-                else:
-                    get_all_extensions_payload['filters'][0]['pageNumber'] = get_all_extensions_payload['filters'][0]['pageNumber'] + 1
-
-        # Output CSV File
-        csv_file = open(CSV_FILE_NAME, 'w')
-        csv_file.write("MS Publisher (Namespace), MS Extension, MS DisplayName, MS Pricing, MS Version, MS Date, VSX Version, VSX Date, VSX Publisher, VSX License, Repo\n")
-        for ext in extensions:
-            print("%s.%s" % (ext['publisher']['publisherName'], ext['extensionName']))
-            ms_extension_name, ms_publisher_name, ms_display_name, ms_latest_version, ms_last_updated, ms_repo, ms_pricing = get_ms_info(ext)
-            vsx_extension_url = '%s/%s/%s' % (VSX_API, ms_publisher_name, ms_extension_name)
-            response = requests.get(vsx_extension_url)
-            if response.status_code == 200:
-                vsx_results = response.json()
-                csv_file.write("%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s\n" % (
-                                ms_publisher_name,
-                                ms_extension_name,
-                                ms_display_name,
-                                ms_pricing,
-                                ms_latest_version,
-                                convert_date_str(ms_last_updated),
-                                vsx_results['version'],
-                                convert_date_str(vsx_results['timestamp']),
-                                vsx_results['publishedBy']['loginName'],
-                                vsx_results.get('license', None),
-                                ms_repo
-                                ))
-            elif response.status_code == 404:
-                csv_file.write("%s, %s, %s, %s, %s, %s, , , , %s, %s\n" % (
-                        ms_publisher_name,
-                        ms_extension_name,
-                        ms_display_name,
-                        ms_pricing,
-                        ms_latest_version,
-                        convert_date_str(ms_last_updated),
-                        vsx_results.get('license', None),
-                        ms_repo
-                        ))
-
-            else:
-                print(response.status_code)
-                print(response.content)
-                response.raise_for_status()
-
-        # Output JSON File
-        json_file = open(JSON_FILE_NAME, 'w')
-        json_file.write(json.dumps(all_extensions, indent=4))
-        json_file.close()
+        collect(args.resume, args.lean)
     except Exception as e:
         print('Error: %s' % e)
-        traceback.print_stack()
+        traceback.print_exc()
+        print('Completed work is kept in %s, run again with --resume to continue.' % JOURNAL_FILE_NAME)
+        sys.exit(1)
@@ -0,0 +1,171 @@
+"""
+Shared HTTP client for the report scripts. All requests go through one pooled
+requests.Session, so connections are kept alive between calls. Failed requests are
+retried with exponential back-off and jitter, each host is limited by a token bucket,
+and 429/503 Retry-After headers pause every request to that host.
+"""
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+
+MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '5'))
+BACKOFF_BASE = float(os.getenv('HTTP_BACKOFF_BASE', '1'))
+BACKOFF_MAX = float(os.getenv('HTTP_BACKOFF_MAX', '60'))
+POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '32'))
+# Default requests per second and burst size for every host, 0 disables the limit
+RATE_LIMIT = float(os.getenv('HTTP_RATE_LIMIT', '20'))
+RATE_BURST = int(os.getenv('HTTP_RATE_BURST', '20'))
+# Requests in flight at once across all hosts and threads, 0 for no limit
+MAX_CONCURRENT_REQUESTS = int(os.getenv('HTTP_MAX_CONCURRENT_REQUESTS', '16'))
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """Allows rate requests per second on average with bursts of up to burst requests."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if self.rate > 0:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.blocked_until and (self.rate <= 0 or self.tokens >= 1):
+                    self.tokens -= 1
+                    return
+                wait = self.blocked_until - now
+                if self.rate > 0:
+                    wait = max(wait, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+session = requests.Session()
+session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+session.mount('https://', adapter)
+session.mount('http://', adapter)
+
+buckets = {}
+rate_limits = {}
+buckets_lock = threading.Lock()
+concurrency_limit = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS) if MAX_CONCURRENT_REQUESTS > 0 else None
+
+def set_concurrency_limit(limit):
+    """Caps the requests in flight at once across every collector in this process."""
+    global concurrency_limit
+    concurrency_limit = threading.BoundedSemaphore(limit) if limit > 0 else None
+
+def set_rate_limit(host, rate, burst=None):
+    """Overrides the default rate limit for one host, e.g. for APIs with a documented quota."""
+    with buckets_lock:
+        rate_limits[host] = (rate, burst if burst is not None else max(int(rate), 1))
+        buckets.pop(host, None)
+
+def get_bucket(host):
+    with buckets_lock:
+        if host not in buckets:
+            rate, burst = rate_limits.get(host, (RATE_LIMIT, RATE_BURST))
+            buckets[host] = TokenBucket(rate, burst)
+        return buckets[host]
+
+def get_retry_after(response):
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        try:
+            retry_date = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max((retry_date - datetime.now(retry_date.tzinfo)).total_seconds(), 0)
+
+def get_backoff(attempt):
+    return random.uniform(0.5, 1) * min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+
+def get_endpoint(url):
+    """Default metrics name for a URL: host and path, with numeric path segments replaced by {id}."""
+    parsed = urlparse(url)
+    return '%s%s' % (parsed.hostname, re.sub(r'/\d+(?=/|$)', '/{id}', parsed.path))
+
+def get_response_size(response, stream=False):
+    # Streamed bodies have not been read yet, so rely on the declared length for those
+    if stream:
+        return int(response.headers.get('Content-Length', 0))
+    return len(response.content)
+
+def request(method, url, retries=MAX_RETRIES, endpoint=None, **kwargs):
+    """
+    Sends a request, retrying connection errors and 429/5xx responses up to retries times.
+    Returns the last response, so callers still decide how to treat error status codes, and
+    raises the last exception if the request never got a response. endpoint names the call in
+    the metrics, e.g. one name for all extension detail URLs instead of one entry per URL.
+    """
+    endpoint = endpoint or get_endpoint(url)
+    bucket = get_bucket(urlparse(url).hostname)
+    attempt = 0
+    while True:
+        bucket.acquire()
+        limit = concurrency_limit
+        if limit is not None:
+            limit.acquire()
+        start = time.monotonic()
+        try:
+            try:
+                response = session.request(method, url, **kwargs)
+            finally:
+                if limit is not None:
+                    limit.release()
+        except requests.exceptions.RequestException as e:
+            metrics.record_request(endpoint, 'error', time.monotonic() - start, 0)
+            if attempt >= retries:
+                raise
+            delay = get_backoff(attempt)
+            # Log the endpoint rather than the URL or exception text, which can carry tokens in the query string
+            print("%s: %s for %s, retrying in %.1fs" % (datetime.now(), type(e).__name__, get_endpoint(url), delay))
+            metrics.record_retry(endpoint)
+            time.sleep(delay)
+            attempt += 1
+            continue
+        metrics.record_request(endpoint, response.status_code, time.monotonic() - start, get_response_size(response, kwargs.get('stream', False)))
+
+        if response.status_code not in RETRY_STATUS_CODES or attempt >= retries:
+            return response
+        delay = get_backoff(attempt)
+        retry_after = get_retry_after(response) if response.status_code in (429, 503) else None
+        if retry_after is not None:
+            # Back off every thread using this host, not only the one that was throttled
+            bucket.pause(retry_after)
+            delay = 0
+        # A streamed response still holds its connection until it is closed
+        response.close()
+        print("%s: HTTP %s for %s, retrying" % (datetime.now(), response.status_code, get_endpoint(url)))
+        metrics.record_retry(endpoint)
+        time.sleep(delay)
+        attempt += 1
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
@@ -0,0 +1,101 @@
+"""
+Request instrumentation for the report scripts. http_client records every outbound call here
+and collectors report the items they produce with count_items. When METRICS_FILE is set the
+totals are written when the process exits, as Prometheus text if the file name ends in .prom
+(for the node exporter textfile collector) and as a JSON summary otherwise.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+
+METRICS_FILE = os.getenv('METRICS_FILE')
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+started = time.monotonic()
+lock = threading.Lock()
+latency_counts = defaultdict(lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+latency_sums = Counter()
+status_counts = Counter()
+retry_counts = Counter()
+byte_counts = Counter()
+item_counts = Counter()
+
+def record_request(endpoint, status, seconds, size):
+    """Records one HTTP attempt; status is the response code or 'error' when no response came back."""
+    with lock:
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))
+        latency_counts[endpoint][bucket] += 1
+        latency_sums[endpoint] += seconds
+        status_counts[(endpoint, str(status))] += 1
+        byte_counts[endpoint] += size
+
+def record_retry(endpoint):
+    with lock:
+        retry_counts[endpoint] += 1
+
+def count_items(collector, count=1):
+    with lock:
+        item_counts[collector] += count
+
+def get_summary():
+    with lock:
+        elapsed = time.monotonic() - started
+        endpoints = {}
+        for endpoint, counts in latency_counts.items():
+            requests = sum(counts)
+            endpoints[endpoint] = {
+                'requests': requests,
+                'mean_latency': latency_sums[endpoint] / requests if requests else 0,
+                'latency_buckets': dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'], counts)),
+                'status': {status: count for (name, status), count in status_counts.items() if name == endpoint},
+                'retries': retry_counts[endpoint],
+                'bytes': byte_counts[endpoint]
+            }
+        items = {collector: {'items': count, 'items_per_second': count / elapsed if elapsed else 0}
+                 for collector, count in item_counts.items()}
+    return {'elapsed_seconds': elapsed, 'endpoints': endpoints, 'items': items}
+
+def format_prometheus(summary):
+    lines = [
+        '# TYPE reports_http_request_duration_seconds histogram',
+    ]
+    for endpoint, data in summary['endpoints'].items():
+        cumulative = 0
+        for bound, count in data['latency_buckets'].items():
+            cumulative += count
+            lines.append('reports_http_request_duration_seconds_bucket{endpoint="%s",le="%s"} %s' % (endpoint, bound, cumulative))
+        lines.append('reports_http_request_duration_seconds_sum{endpoint="%s"} %s' % (endpoint, data['mean_latency'] * data['requests']))
+        lines.append('reports_http_request_duration_seconds_count{endpoint="%s"} %s' % (endpoint, data['requests']))
+    lines.append('# TYPE reports_http_responses_total counter')
+    for endpoint, data in summary['endpoints'].items():
+        for status, count in data['status'].items():
+            lines.append('reports_http_responses_total{endpoint="%s",status="%s"} %s' % (endpoint, status, count))
+    lines.append('# TYPE reports_http_retries_total counter')
+    for endpoint, data in summary['endpoints'].items():
+        lines.append('reports_http_retries_total{endpoint="%s"} %s' % (endpoint, data['retries']))
+    lines.append('# TYPE reports_http_response_bytes_total counter')
+    for endpoint, data in summary['endpoints'].items():
+        lines.append('reports_http_response_bytes_total{endpoint="%s"} %s' % (endpoint, data['bytes']))
+    lines.append('# TYPE reports_items_total counter')
+    for collector, data in summary['items'].items():
+        lines.append('reports_items_total{collector="%s"} %s' % (collector, data['items']))
+    lines.append('# TYPE reports_items_per_second gauge')
+    for collector, data in summary['items'].items():
+        lines.append('reports_items_per_second{collector="%s"} %s' % (collector, data['items_per_second']))
+    return '\n'.join(lines) + '\n'
+
+def write_metrics(filename=METRICS_FILE):
+    summary = get_summary()
+    with open(filename, 'w') as f:
+        if filename.endswith('.prom'):
+            f.write(format_prometheus(summary))
+        else:
+            json.dump(summary, f, indent=4)
+
+if METRICS_FILE:
+    atexit.register(write_metrics)
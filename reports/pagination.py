@@ -0,0 +1,81 @@
+"""
+Helpers for retrieving paged API results concurrently. Used by get_all_extensions and
+get_vs_marketplace_data.
+"""
+import math
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import requests
+import http_client
+
+# Number of pages to request in parallel once the total is known
+PAGE_WORKERS = int(os.getenv('PAGE_WORKERS', '4'))
+
+def is_transient(error):
+    """True for connection errors and 429/5xx responses, which may succeed when tried later."""
+    if isinstance(error, requests.exceptions.ConnectionError):
+        return True
+    return (isinstance(error, requests.exceptions.HTTPError) and error.response is not None
+            and error.response.status_code in http_client.RETRY_STATUS_CODES)
+
+def fetch_page_with_retry(fetch_page, index, retry_count=2):
+    """
+    Fetches a page, trying again after a pause when http_client has used up its own retries on
+    a transient error. Other errors, such as a 404 or an unexpected response, fail at once.
+    """
+    attempt = 0
+    while True:
+        try:
+            return fetch_page(index)
+        except requests.exceptions.RequestException as e:
+            attempt += 1
+            if attempt >= retry_count or not is_transient(e):
+                raise
+            print("%s: page %s failed (%s), retrying..." % (datetime.now(), index, e))
+            time.sleep(2 ** attempt)
+
+def iter_pages(fetch_page, page_size, max_workers=PAGE_WORKERS, journal=None, kind='page'):
+    """
+    Yields (items, total) for every page in order. fetch_page(index) returns the items of the
+    zero-based page index and the total item count. The first page is fetched alone to learn
+    the total, then the remaining pages are fetched concurrently with at most 2 * max_workers
+    pages buffered. A page that keeps failing raises instead of truncating the results.
+    With a checkpoint journal, pages it already holds are not fetched again and new pages are
+    recorded in it under kind.
+    """
+    def fetch(index):
+        page = journal.get_page(kind, index) if journal is not None else None
+        if page is None:
+            page = fetch_page_with_retry(fetch_page, index)
+        return page
+
+    def complete(index, page):
+        if journal is not None:
+            journal.record_page(kind, index, *page)
+        return page
+
+    items, total = complete(0, fetch(0))
+    retrieved = len(items)
+    yield items, total
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for index in range(1, math.ceil(total / page_size)):
+            pending.append((index, executor.submit(fetch, index)))
+            if len(pending) >= max_workers * 2:
+                index, future = pending.popleft()
+                items, _ = complete(index, future.result())
+                retrieved += len(items)
+                yield items, total
+        while pending:
+            index, future = pending.popleft()
+            items, _ = complete(index, future.result())
+            retrieved += len(items)
+            yield items, total
+
+    if retrieved != total:
+        # The catalog can change while it is being paged, so report rather than fail
+        print("%s: expected %s items but retrieved %s" % (datetime.now(), total, retrieved))
@@ -0,0 +1,127 @@
+"""
+Compares two catalog snapshots written by get_all_extensions.py (extensions.ndjson) and
+reports the extensions that were added, removed, or whose version, license, downloads or
+other fields changed:
+
+    python snapshot_diff.py old/extensions.ndjson new/extensions.ndjson -o changes.ndjson
+
+The old snapshot is reduced to a key, a few digests and three values per extension, and
+the new one is compared line by line, so neither file is ever held in memory.
+"""
+import argparse
+import hashlib
+import json
+import os
+import struct
+import sys
+
+# Fields digested individually so a change report can name them. Changes to any other
+# field are reported as 'other'.
+DIFF_FIELDS = ['version', 'license', 'timestamp', 'displayName', 'description', 'repository',
+               'categories', 'tags', 'verified', 'deprecated', 'engines', 'dependencies']
+
+# Fields whose old and new values are included in the report
+VALUE_FIELDS = ['version', 'license', 'downloadCount']
+
+# downloadCount changes on nearly every crawl, so only larger jumps are reported
+DOWNLOAD_JUMP = int(os.getenv('DOWNLOAD_JUMP', '1000'))
+
+DIGEST_SIZE = 8
+
+# Field digests only have to agree within one run, so the built-in hash() is used for plain
+# values and only lists and objects are serialized first
+field_digests_format = struct.Struct('<%dq' % len(DIFF_FIELDS))
+
+# Reused for every value; json.dumps would build a new encoder per call
+encoder = json.JSONEncoder(sort_keys=True, separators=(',', ':'))
+
+def read_snapshot(filename):
+    with open(filename) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def get_key(extension):
+    return '%s.%s' % (extension['namespace'], extension['name'])
+
+def get_digest(value):
+    return hashlib.blake2b(encoder.encode(value).encode(), digest_size=DIGEST_SIZE).digest()
+
+def get_field_digest(value):
+    if isinstance(value, (list, dict)):
+        value = encoder.encode(value)
+    return hash((type(value), value))
+
+def summarize(extension):
+    """
+    Returns (field digests, record digest, values) for extension. The field digests are
+    joined into one bytes object, in DIFF_FIELDS order, to keep the old snapshot small.
+    """
+    field_digests = field_digests_format.pack(*[get_field_digest(extension.get(field)) for field in DIFF_FIELDS])
+    other = {k: v for k, v in extension.items() if k not in DIFF_FIELDS and k != 'downloadCount'}
+    values = tuple(extension.get(field) for field in VALUE_FIELDS)
+    return field_digests, get_digest(other), values
+
+def get_changed_fields(old_digests, new_digests):
+    changed = []
+    for i, field in enumerate(DIFF_FIELDS):
+        start = i * DIGEST_SIZE
+        if old_digests[start:start + DIGEST_SIZE] != new_digests[start:start + DIGEST_SIZE]:
+            changed.append(field)
+    return changed
+
+def iter_changes(old_filename, new_filename, download_jump=DOWNLOAD_JUMP):
+    """Yields one change record per added, removed or changed extension."""
+    old = {get_key(e): summarize(e) for e in read_snapshot(old_filename)}
+    for extension in read_snapshot(new_filename):
+        key = get_key(extension)
+        new_digests, new_other, new_values = summarize(extension)
+        summary = old.pop(key, None)
+        if summary is None:
+            yield {'change': 'added', 'extension': key, 'values': dict(zip(VALUE_FIELDS, new_values))}
+            continue
+        old_digests, old_other, old_values = summary
+        fields = get_changed_fields(old_digests, new_digests) if old_digests != new_digests else []
+        if old_other != new_other:
+            fields.append('other')
+        old_downloads = old_values[VALUE_FIELDS.index('downloadCount')] or 0
+        new_downloads = new_values[VALUE_FIELDS.index('downloadCount')] or 0
+        if abs(new_downloads - old_downloads) >= download_jump:
+            fields.append('downloadCount')
+        if fields:
+            yield {'change': 'changed', 'extension': key, 'fields': fields,
+                   'values': {field: [old_value, new_value]
+                              for field, old_value, new_value in zip(VALUE_FIELDS, old_values, new_values)
+                              if old_value != new_value}}
+    # Whatever was not matched by the new snapshot has been removed
+    for key, (_, _, old_values) in old.items():
+        yield {'change': 'removed', 'extension': key, 'values': dict(zip(VALUE_FIELDS, old_values))}
+
+def get_change_type(change):
+    if change['change'] != 'changed':
+        return change['change']
+    for field in ('version', 'license', 'downloadCount'):
+        if field in change['fields']:
+            return field
+    return 'other'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report the differences between two extensions.ndjson snapshots.')
+    parser.add_argument('old', help='the earlier snapshot')
+    parser.add_argument('new', help='the later snapshot')
+    parser.add_argument('-o', '--output', help='write the change records here instead of standard output')
+    parser.add_argument('--download-jump', type=int, default=DOWNLOAD_JUMP,
+                        help='smallest change in downloadCount worth reporting (default %(default)s)')
+    args = parser.parse_args()
+
+    output = sys.stdout if args.output is None else open(args.output, 'w')
+    counts = {}
+    for change in iter_changes(args.old, args.new, args.download_jump):
+        output.write(json.dumps(change) + '\n')
+        change_type = get_change_type(change)
+        counts[change_type] = counts.get(change_type, 0) + 1
+    if args.output is not None:
+        output.close()
+    for change_type in ('added', 'removed', 'version', 'license', 'downloadCount', 'other'):
+        print('%s: %s' % (change_type, counts.get(change_type, 0)), file=sys.stderr)
@@ -0,0 +1,267 @@
+"""
+Local stand-in for the APIs used by the report scripts, serving a synthetic catalog so the
+collectors can be benchmarked without calling open-vsx.org, Better Stack or the VS Code
+Marketplace. Used by benchmark.py. Implements:
+   - Open VSX api/-/search, api/{namespace}/{name}, admin/reports, admin/report and
+     admin/report/schedule
+   - Better Stack api/v2/monitors and api/v2/monitors/{id}/sla
+   - VS Code Marketplace _apis/public/gallery/extensionquery
+
+Extensions are generated from their index on demand, so large catalogs cost no memory.
+"""
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+LICENSES = ['MIT', 'Apache-2.0', 'EPL-2.0', 'GPL-3.0', 'BSD-3-Clause', None]
+
+class Catalog:
+    """Synthetic Open VSX and Marketplace catalogs, deterministic for a given seed."""
+
+    def __init__(self, size, ms_size=None, overlap=0.5, namespaces=None, monitors=4, days=365, seed=0):
+        self.size = size
+        self.ms_size = size if ms_size is None else ms_size
+        self.overlap = overlap
+        self.namespaces = namespaces or max(size // 5, 1)
+        self.monitors = monitors
+        self.start_date = date.today() - timedelta(days=days)
+        self.seed = seed
+
+    def get_random(self, *key):
+        return random.Random(repr((self.seed,) + key))
+
+    def get_search_entry(self, index):
+        rng = self.get_random('vsx', index)
+        namespace = 'ns%s' % (index % self.namespaces)
+        name = 'ext%s' % index
+        return {
+            'url': 'api/%s/%s' % (namespace, name),
+            'namespace': namespace,
+            'name': name,
+            'version': '1.%s.%s' % (rng.randint(0, 20), rng.randint(0, 9)),
+            'timestamp': '%sT00:00:00Z' % (self.start_date + timedelta(days=rng.randint(0, 365))),
+            'downloadCount': rng.randint(0, 1000000),
+            'averageRating': round(rng.uniform(1, 5), 1),
+            'displayName': 'Extension %s' % index,
+            'description': 'Synthetic extension %s' % index,
+            'verified': rng.random() < 0.5,
+            'deprecated': False
+        }
+
+    def get_extension(self, namespace, name):
+        try:
+            index = int(name[len('ext'):])
+        except ValueError:
+            return None
+        if index < 0 or index >= self.size or namespace != 'ns%s' % (index % self.namespaces):
+            return None
+        extension = self.get_search_entry(index)
+        rng = self.get_random('detail', index)
+        versions = rng.randint(1, 20)
+        extension.update({
+            'license': rng.choice(LICENSES),
+            'publishedBy': {'loginName': 'user%s' % (index % self.namespaces), 'fullName': 'User %s' % index},
+            'reviewCount': rng.randint(0, 50),
+            'allVersions': {'1.0.%s' % v: 'api/%s/%s/1.0.%s' % (namespace, name, v) for v in range(versions)},
+            'files': {'download': 'api/%s/%s/file.vsix' % (namespace, name)},
+            'preRelease': False,
+            'unrelatedPublisher': False,
+            'namespaceAccess': 'restricted',
+            'preview': False,
+            'repository': 'https://github.com/%s/%s' % (namespace, name),
+            'categories': ['Other'],
+            'tags': [],
+            'dependencies': [],
+            'bundledExtensions': []
+        })
+        return extension
+
+    def get_ms_extension(self, index):
+        rng = self.get_random('ms', index)
+        # The first overlap share of the Marketplace catalog is also published on Open VSX
+        if index < self.ms_size * self.overlap and index < self.size:
+            publisher, name = 'ns%s' % (index % self.namespaces), 'ext%s' % index
+        else:
+            publisher, name = 'mspub%s' % (index % 1000), 'msext%s' % index
+        return {
+            'extensionName': name,
+            'displayName': 'MS Extension %s' % index,
+            'publisher': {'publisherName': publisher},
+            'versions': [{
+                'version': '2.%s.0' % rng.randint(0, 20),
+                'lastUpdated': '%sT00:00:00Z' % (self.start_date + timedelta(days=rng.randint(0, 365))),
+                'properties': [
+                    {'key': 'Microsoft.VisualStudio.Services.Links.Source', 'value': 'https://github.com/%s/%s' % (publisher, name)},
+                    {'key': 'Microsoft.VisualStudio.Services.Content.Pricing', 'value': 'Free'}
+                ]
+            }]
+        }
+
+    def get_report_months(self):
+        month = date(self.start_date.year, self.start_date.month, 1)
+        today = date.today()
+        while (month.year, month.month) < (today.year, today.month):
+            yield month.year, month.month
+            month = (month + timedelta(days=32)).replace(day=1)
+
+    def get_admin_report(self, year, month):
+        rng = self.get_random('report', year, month)
+        top = min(self.namespaces, 10)
+        return {
+            'year': year,
+            'month': month,
+            'extensions': self.size,
+            'downloads': rng.randint(0, 10000000),
+            'downloadsTotal': rng.randint(0, 1000000000),
+            'publishers': self.namespaces,
+            'averageReviewsPerExtension': round(rng.uniform(0, 3), 2),
+            'namespaceOwners': self.namespaces,
+            'topMostActivePublishingUsers': [{'userLoginName': 'user%s' % rng.randrange(self.namespaces), 'extensionVersionPublishedCount': rng.randint(1, 500)} for _ in range(top)],
+            'topNamespaceExtensions': [{'namespace': 'ns%s' % rng.randrange(self.namespaces), 'extensionCount': rng.randint(1, 100)} for _ in range(top)],
+            'topNamespaceExtensionVersions': [{'namespace': 'ns%s' % rng.randrange(self.namespaces), 'extensionVersionCount': rng.randint(1, 1000)} for _ in range(top)],
+            'topMostDownloadedExtensions': [{'extensionIdentifier': 'ns0.ext%s' % rng.randrange(self.size), 'downloadCount': rng.randint(1, 10000000)} for _ in range(top)]
+        }
+
+    def get_monitor(self, index):
+        return {
+            'id': str(index),
+            'attributes': {
+                'url': 'https://open-vsx.org/monitored/%s' % index,
+                'pronounceable_name': 'Monitor %s' % index,
+                'created_at': '%sT00:00:00.000Z' % self.start_date
+            }
+        }
+
+    def get_sla(self, monitor_id, from_date, to_date):
+        days = (to_date - from_date).days + 1
+        downtime = sum(self.get_random('downtime', monitor_id, (from_date + timedelta(days=i)).toordinal()).choice([0, 0, 0, 0, 60, 600])
+                       for i in range(days))
+        return {'data': {'id': monitor_id, 'attributes': {
+            'availability': round(100 * (1 - downtime / (days * 86400)), 4),
+            'total_downtime': downtime
+        }}}
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, catalog, latency=0.0, error_rate=0.0, port=0):
+        super().__init__(('127.0.0.1', port), StandInHandler)
+        self.catalog = catalog
+        self.latency = latency
+        self.error_rate = error_rate
+        self.stats = Counter()
+        self.url_counts = Counter()
+        self.stats_lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:%s/' % self.server_address[1]
+
+    def count(self, endpoint, url, status, size):
+        with self.stats_lock:
+            self.stats['requests'] += 1
+            self.stats['requests.%s' % endpoint] += 1
+            self.stats['status.%s' % status] += 1
+            self.stats['bytes'] += size
+            self.url_counts[url] += 1
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.stats = Counter()
+            self.url_counts = Counter()
+
+    def get_stats(self):
+        with self.stats_lock:
+            stats = dict(self.stats)
+            # A URL requested more than once was either retried or not deduplicated by the client
+            stats['repeated_requests'] = sum(count - 1 for count in self.url_counts.values())
+        return stats
+
+    def handle_error(self, request, client_address):
+        # Clients that are killed mid-request (e.g. when testing --resume) are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def handle_request(self, method):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+        endpoint, status, payload, headers = self.route(method, url.path.strip('/').split('/'), query, body)
+        if self.server.latency:
+            time.sleep(self.server.latency * random.uniform(0.5, 1.5))
+        if status == 200 and random.random() < self.server.error_rate:
+            status, payload, headers = 503, {'error': 'injected'}, {}
+        data = b'' if payload is None else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+        self.server.count(endpoint, self.path, status, len(data))
+
+    def route(self, method, parts, query, body):
+        catalog = self.server.catalog
+        if parts[:3] == ['api', '-', 'search']:
+            offset, size = int(query.get('offset', 0)), int(query.get('size', 18))
+            entries = [catalog.get_search_entry(i) for i in range(offset, min(offset + size, catalog.size))]
+            return 'search', 200, {'offset': offset, 'totalSize': catalog.size, 'extensions': entries}, {}
+        if parts[:3] == ['api', 'v2', 'monitors']:
+            if len(parts) == 3:
+                monitors = [catalog.get_monitor(i) for i in range(catalog.monitors)]
+                return 'monitors', 200, {'data': monitors, 'pagination': {'next': None}}, {}
+            from_date = datetime.strptime(query['from'], '%Y-%m-%d').date()
+            to_date = datetime.strptime(query['to'], '%Y-%m-%d').date()
+            return 'sla', 200, catalog.get_sla(parts[3], from_date, to_date), {}
+        if len(parts) == 3 and parts[0] == 'api':
+            extension = catalog.get_extension(parts[1], parts[2])
+            if extension is None:
+                return 'extension', 404, {'error': 'not found'}, {}
+            etag = '"%s"' % extension['version']
+            if self.headers.get('If-None-Match') == etag:
+                return 'extension', 304, None, {'ETag': etag}
+            return 'extension', 200, extension, {'ETag': etag}
+        if parts == ['admin', 'reports']:
+            reports = {}
+            for year, month in catalog.get_report_months():
+                reports.setdefault(str(year), []).append(month)
+            return 'admin_reports', 200, reports, {}
+        if parts == ['admin', 'report']:
+            return 'admin_report', 200, catalog.get_admin_report(int(query['year']), int(query['month'])), {}
+        if parts == ['admin', 'report', 'schedule'] and method == 'POST':
+            return 'admin_schedule', 200, {}, {}
+        if parts[-1:] == ['extensionquery'] and method == 'POST':
+            query_filter = json.loads(body)['filters'][0]
+            page_size, page_number = query_filter['pageSize'], query_filter['pageNumber']
+            start = (page_number - 1) * page_size
+            extensions = [catalog.get_ms_extension(i) for i in range(start, min(start + page_size, catalog.ms_size))]
+            return 'extensionquery', 200, {'results': [{
+                'extensions': extensions,
+                'resultMetadata': [{'metadataType': 'ResultCount', 'metadataItems': [{'name': 'TotalCount', 'count': catalog.ms_size}]}]
+            }]}, {}
+        return 'unknown', 404, {'error': 'not found'}, {}